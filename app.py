@@ -1,11 +1,28 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g, abort
+from flask import Flask, render_template, request, flash, redirect, session, g, abort, jsonify, url_for
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import HTTPException
 
+from commands import register_commands
+import db_pool
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
-from models import db, connect_db, User, Message
+from fragments import FragmentCache
+from hashing import HashingBusy, hasher
+from identity import CurrentUser, IdentityCache, snapshot_of
+import http_cache
+import instrumentation
+import jobs
+from instrumentation import query_budget
+from models import db, connect_db, User, Message, Follows, Likes, Timeline
+from pagination import paginate
+import queries
+import replicas
+from replicas import replica_reads
+import serializers
+from search import autocomplete, search_users
+import warmup
 
 CURR_USER_KEY = "curr_user"
 
@@ -15,14 +32,54 @@ app = Flask(__name__)
 # if not set there, use development local db.
 app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
+app.config['DATABASE_REPLICA_URLS'] = [
+    url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+app.config['REPLICA_STICKY_SECONDS'] = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_PRE_PING'] = bool(int(os.environ.get('DB_POOL_PRE_PING', 1)))
+app.config['DB_CONNECT_TIMEOUT'] = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))
+app.config['DB_STATEMENT_TIMEOUT'] = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+app.config['MESSAGES_PER_PAGE'] = int(os.environ.get('MESSAGES_PER_PAGE', 20))
+app.config['USERS_PER_PAGE'] = int(os.environ.get('USERS_PER_PAGE', 24))
+app.config['IDENTITY_CACHE_SIZE'] = int(os.environ.get('IDENTITY_CACHE_SIZE', 1024))
+app.config['IDENTITY_CACHE_TTL'] = int(os.environ.get('IDENTITY_CACHE_TTL', 60))
+app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 10000))
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['HASH_WORKERS'] = int(os.environ.get('HASH_WORKERS', os.cpu_count() or 1))
+app.config['HASH_MAX_PENDING'] = int(
+    os.environ.get('HASH_MAX_PENDING', 2 * app.config['HASH_WORKERS'] or 1))
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOBS_INLINE'] = bool(int(os.environ.get('JOBS_INLINE', 0)))
+app.config['JOB_LEASE_SECONDS'] = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+app.config['JOB_RETRY_DELAY'] = int(os.environ.get('JOB_RETRY_DELAY', 5))
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = int(os.environ.get('STATIC_MAX_AGE', 3600))
+app.config['QUERY_BUDGET_STRICT'] = bool(int(os.environ.get('QUERY_BUDGET_STRICT', 0)))
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('TEMPLATE_CACHE_DIR') or None
+app.config['WARMUP'] = bool(int(os.environ.get('WARMUP', 0)))
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+instrumentation.init_app(app)
+replicas.init_app(app)
+db_pool.init_app(app, db)
+http_cache.init_app(app)
+register_commands(app)
+hasher.init_app(app)
+warmup.init_app(app)
+jobs.init_app(app)
+
+identity_cache = IdentityCache(maxsize=app.config['IDENTITY_CACHE_SIZE'],
+                               ttl=app.config['IDENTITY_CACHE_TTL'])
+fragment_cache = FragmentCache(maxsize=app.config['FRAGMENT_CACHE_SIZE'])
+fragment_cache.init_app(app)
 
 
 ##############################################################################
@@ -31,10 +88,13 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    The user row isn't loaded here; see identity.CurrentUser.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = CurrentUser(session[CURR_USER_KEY], identity_cache)
 
     else:
         g.user = None
@@ -44,6 +104,7 @@ def do_login(user):
     """Log in user."""
 
     session[CURR_USER_KEY] = user.id
+    identity_cache.put(snapshot_of(user))
 
 
 def do_logout():
@@ -101,6 +162,7 @@ def login():
                                  form.password.data)
 
         if user:
+            db.session.commit()  # keep any re-hashed password
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -119,67 +181,168 @@ def logout():
     return redirect('/login')
 
 
+##############################################################################
+# Page helpers
+
+
+def cursor_page(query, timestamp_col, id_col, per_page):
+    """Page through `query` using the request's `before` cursor.
+
+    Aborts with a 400 if the cursor is malformed.
+    """
+
+    try:
+        return paginate(query, timestamp_col, id_col,
+                        before=request.args.get('before'),
+                        per_page=per_page)
+    except ValueError:
+        abort(400)
+
+
+def followed_ids(users):
+    """Ids among `users` that the logged-in user follows, in one query."""
+
+    if not g.user:
+        return set()
+
+    return g.user.following_ids([user.id for user in users])
+
+
+def liked_ids(messages):
+    """Ids among `messages` that the logged-in user likes, in one query."""
+
+    if not g.user:
+        return set()
+
+    return g.user.liked_ids([message.id for message in messages])
+
+
 ##############################################################################
 # General user routes:
 
 @app.route('/users')
+@query_budget(4)
+@replica_reads
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search usernames, bios and
+    locations (best matches first, paged with 'page'). Without one, lists
+    users in signup order, paged with an 'after' user id cursor.
     """
 
     search = request.args.get('q')
+    per_page = app.config['USERS_PER_PAGE']
 
     if not search:
-        users = User.query.all()
+        after = request.args.get('after', 0, type=int)
+        users = (User
+                 .query
+                 .filter(User.id > after)
+                 .order_by(User.id)
+                 .limit(per_page + 1)
+                 .all())
+        next_url = None
+        if len(users) > per_page:
+            users = users[:per_page]
+            next_url = url_for('list_users', after=users[-1].id)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        try:
+            results = search_users(search,
+                                   page=request.args.get('page', 1, type=int),
+                                   per_page=per_page)
+        except ValueError:
+            abort(400)
+        users = results.items
+        next_url = None
+        if results.has_next:
+            next_url = url_for('list_users', q=search, page=results.page + 1)
+
+    return render_template('users/index.html', users=users, next_url=next_url,
+                           following_ids=followed_ids(users))
+
+
+@app.route('/users/autocomplete')
+@query_budget(1)
+@replica_reads
+def users_autocomplete():
+    """JSON list of usernames starting with the 'q' param."""
 
-    return render_template('users/index.html', users=users)
+    return jsonify(usernames=autocomplete(request.args.get('q', '')))
 
 
 @app.route('/users/<int:user_id>')
+@query_budget(6)
+@replica_reads
 def users_show(user_id):
-    """Show user profile."""
+    """Show user profile.
+
+    Messages are paged newest first; pass the `before` cursor from the
+    previous page in the querystring to see older ones.
+    """
 
     user = User.query.get_or_404(user_id)
 
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    likes = [message.id for message in user.likes]
-    return render_template('users/show.html', user=user, messages=messages, likes=likes)
+    def render():
+        # snagging messages in order from the database;
+        # user.messages won't be in order by default
+        page = cursor_page(Message.query.filter(Message.user_id == user_id),
+                           Message.timestamp, Message.id,
+                           app.config['MESSAGES_PER_PAGE'])
+        return render_template('users/show.html', user=user, messages=page.items,
+                               next_cursor=page.next_cursor,
+                               liked_ids=liked_ids(page.items))
+
+    # posting or deleting a message changes the user's message_count, and
+    # so their updated_at
+    return http_cache.conditional(render, user.id, user.updated_at)
 
 
 
 @app.route('/users/<int:user_id>/following')
+@query_budget(4)
+@replica_reads
 def show_following(user_id):
-    """Show list of people this user is following."""
+    """Show list of people this user is following.
+
+    Most recently followed first, a page at a time; pass the `before`
+    cursor from the previous page to see more.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    page = cursor_page(queries.following(user.id),
+                       Follows.timestamp, Follows.user_being_followed_id,
+                       app.config['USERS_PER_PAGE'])
+    return render_template('users/following.html', user=user,
+                           following=page.items, next_cursor=page.next_cursor,
+                           following_ids=followed_ids(page.items))
 
 
 @app.route('/users/<int:user_id>/followers')
+@query_budget(4)
+@replica_reads
 def users_followers(user_id):
-    """Show list of followers of this user."""
+    """Show list of followers of this user.
+
+    Most recent followers first, a page at a time; pass the `before`
+    cursor from the previous page to see more.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    page = cursor_page(queries.followers(user.id),
+                       Follows.timestamp, Follows.user_following_id,
+                       app.config['USERS_PER_PAGE'])
+    return render_template('users/followers.html', user=user,
+                           followers=page.items, next_cursor=page.next_cursor,
+                           following_ids=followed_ids(page.items))
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -192,6 +355,8 @@ def add_follow(follow_id):
 
     followed_user = User.query.get_or_404(follow_id)
     g.user.following.append(followed_user)
+    db.session.flush()
+    Timeline.backfill(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -207,21 +372,39 @@ def stop_following(follow_id):
 
     followed_user = User.query.get(follow_id)
     g.user.following.remove(followed_user)
+    Timeline.prune(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
 @app.route('/users/<int:user_id>/likes', methods=['GET', 'POST'])
+@query_budget(4)
+@replica_reads
 def show_likes(user_id):
-    """Shows users liked messages."""
+    """Shows users liked messages.
+
+    Most recently liked first, a page at a time; pass the `before`
+    cursor from the previous page to see more.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('/users/likes.html', user=user, likes=user.likes)
+    page = cursor_page(queries.liked_messages(user.id),
+                       Likes.timestamp, Likes.id,
+                       app.config['MESSAGES_PER_PAGE'])
+    likes = page.items
+    if user.id == g.user.id:
+        # everything on your own likes page is liked by you
+        liked = {message.id for message in likes}
+    else:
+        liked = liked_ids(likes)
+
+    return render_template('/users/likes.html', user=user, likes=likes,
+                           next_cursor=page.next_cursor, liked_ids=liked)
 
 
 @app.route('/users/profile', methods=["GET", "POST"])
@@ -242,6 +425,8 @@ def profile():
             user.header_image_url = form.header_image_url.data or "/static/images/warbler-hero.jpg"
             user.bio = form.bio.data
             db.session.commit()
+            identity_cache.invalidate(user.id)
+            fragment_cache.invalidate_user(user.id)
             return redirect (f'/users/{user.id}')
         flash ('Password Incorrect', 'danger')
     return render_template('users/edit.html', form=form, user_id=user.id)
@@ -258,8 +443,12 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    # the user's messages, follows and likes can run to many thousands of
+    # rows (and counter updates); delete them after responding
+    jobs.enqueue('users.delete', key=f'users.delete:{g.user.id}', user_id=g.user.id)
     db.session.commit()
+    identity_cache.invalidate(g.user.id)
+    fragment_cache.invalidate_user(g.user.id)
 
     return redirect("/signup")
 
@@ -283,6 +472,8 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        jobs.enqueue('timeline.push', key=f'timeline.push:{msg.id}', message_id=msg.id)
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -291,34 +482,77 @@ def messages_add():
 
 
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@query_budget(3)
+@replica_reads
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = queries.message_with_author(message_id)
+    if msg is None:
+        abort(404)
+
+    return http_cache.conditional(
+        lambda: render_template('messages/show.html', message=msg),
+        msg.id, msg.user.updated_at)
+
+
+def likeable_message_or_abort(message_id):
+    """404 for a missing message; 403 for the current user's own message."""
+
+    author_id = (db.session
+                 .query(Message.user_id)
+                 .filter(Message.id == message_id)
+                 .scalar())
+    if author_id is None:
+        abort(404)
+    if author_id == g.user.id:
+        abort(403)
 
 
 @app.route('/messages/<int:message_id>/like', methods=['GET', 'POST'])
 def messages_like(message_id):
-    """Like a message"""
+    """Like a message, or unlike it if it's already liked."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    liked_message = Message.query.get_or_404(message_id)
-    if liked_message == g.user.id:
-        return abort(403)
+    likeable_message_or_abort(message_id)
+    Likes.toggle(g.user.id, message_id)
+    db.session.commit()
 
-    user_likes = g.user.likes
-    
-    if liked_message in user_likes:
-        g.user.likes = [like for like in user_likes if like != liked_message]
+    return redirect('/')
+
+
+@app.route('/messages/<int:message_id>/like.json', methods=['POST'])
+@app.route('/api/v1/messages/<int:message_id>/like', methods=['POST'])
+def messages_like_json(message_id):
+    """Like or unlike a message for AJAX clients.
+
+    With a JSON body of {"liked": true} or {"liked": false}, sets that
+    state (repeating the request changes nothing); without one, toggles.
+    Responds with the message's new state and like count.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    likeable_message_or_abort(message_id)
+
+    wanted = (request.get_json(silent=True) or {}).get('liked')
+    if wanted is None:
+        liked = Likes.toggle(g.user.id, message_id)
+    elif wanted:
+        Likes.like(g.user.id, message_id)
+        liked = True
     else:
-        g.user.likes.append(liked_message)
+        Likes.unlike(g.user.id, message_id)
+        liked = False
 
+    like_count = Likes.count_for(message_id)
     db.session.commit()
-    return redirect('/')
+
+    return jsonify(message_id=message_id, liked=liked, like_count=like_count)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=['GET', 'POST'])
@@ -330,53 +564,164 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+    Timeline.remove(msg.id)
     db.session.delete(msg)
     db.session.commit()
+    fragment_cache.invalidate_message(message_id)
 
     return redirect(f"/users/{g.user.id}")
 
 
+##############################################################################
+# JSON API (v1)
+#
+# The same timeline, profile and actions as the HTML views, for clients
+# that render for themselves: no redirects, compact JSON, and the same
+# `before` cursors for paging. Logged in through the same session cookie.
+
+
+@app.errorhandler(HTTPException)
+def api_error(e):
+    """Errors under /api/ are JSON; elsewhere, Flask's HTML pages."""
+
+    if request.path.startswith('/api/'):
+        return jsonify(error=e.description), e.code
+    return e
+
+
+def api_user_or_abort():
+    if not g.user:
+        abort(401, "Access unauthorized.")
+
+
+@app.route('/api/v1/timeline')
+@query_budget(3)
+@replica_reads
+def api_timeline():
+    """A page of the logged-in user's timeline, newest first."""
+
+    api_user_or_abort()
+
+    page = cursor_page(queries.with_authors(Timeline.query_for(g.user.id)),
+                       Timeline.timestamp, Timeline.message_id,
+                       app.config['MESSAGES_PER_PAGE'])
+    return jsonify(serializers.message_page(page, liked_ids(page.items)))
+
+
+@app.route('/api/v1/users/<int:user_id>')
+@query_budget(7)
+@replica_reads
+def api_users_show(user_id):
+    """A user's profile and a page of their messages, newest first."""
+
+    user = User.query.get_or_404(user_id)
+
+    def render():
+        page = cursor_page(Message.query.filter(Message.user_id == user_id),
+                           Message.timestamp, Message.id,
+                           app.config['MESSAGES_PER_PAGE'])
+        viewer = g.user and g.user.id != user.id
+        return jsonify(
+            user=serializers.user_profile(
+                user, following=g.user.is_following(user) if viewer else None),
+            messages=serializers.message_page(
+                page, liked_ids(page.items) if viewer else None, author=user))
+
+    return http_cache.conditional(render, user.id, user.updated_at)
+
+
+@app.route('/api/v1/users/<int:user_id>/follow', methods=['POST'])
+def api_follow(user_id):
+    """Follow or unfollow a user.
+
+    With a JSON body of {"following": true} or {"following": false}, sets
+    that state (repeating the request changes nothing); without one,
+    toggles. Responds with the new state and the user's follower count.
+    """
+
+    api_user_or_abort()
+    if user_id == g.user.id:
+        abort(403, "You can't follow yourself.")
+
+    followed_user = User.query.get_or_404(user_id)
+    following = g.user.is_following(followed_user)
+
+    wanted = (request.get_json(silent=True) or {}).get('following')
+    if wanted is None:
+        wanted = not following
+
+    if wanted and not following:
+        g.user.following.append(followed_user)
+        db.session.flush()
+        Timeline.backfill(g.user.id, followed_user.id)
+    elif following and not wanted:
+        g.user.following.remove(followed_user)
+        Timeline.prune(g.user.id, followed_user.id)
+    db.session.commit()
+
+    return jsonify(user_id=user_id, following=bool(wanted),
+                   follower_count=followed_user.follower_count)
+
+
+@app.route('/api/v1/messages', methods=['POST'])
+def api_messages_add():
+    """Post a message from a JSON body of {"text": ...}."""
+
+    api_user_or_abort()
+
+    text = (request.get_json(silent=True) or {}).get('text')
+    if not isinstance(text, str) or not text.strip():
+        abort(400, "A message needs some text.")
+    if len(text) > Message.text.type.length:
+        abort(400, f"Messages are at most {Message.text.type.length} characters.")
+
+    msg = Message(text=text, user_id=g.user.id)
+    db.session.add(msg)
+    db.session.flush()
+    jobs.enqueue('timeline.push', key=f'timeline.push:{msg.id}', message_id=msg.id)
+    db.session.commit()
+
+    return (jsonify(serializers.message(msg, author=g.user)), 201,
+            {'Location': f'/messages/{msg.id}'})
+
+
 ##############################################################################
 # Homepage and error pages
 
 
+@app.errorhandler(HashingBusy)
+def hashing_busy(e):
+    """Too many password hashes queued: shed load rather than wait."""
+
+    return "Too many logins right now; please try again.", 503, {'Retry-After': '1'}
+
+
 @app.route('/')
+@query_budget(3)
+@replica_reads
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, read from the
+      user's precomputed timeline a page at a time
     """
 
     if g.user:
-        following_ids = [f.id for f in g.user.following] + [g.user.id]
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        page = cursor_page(queries.with_authors(Timeline.query_for(g.user.id)),
+                           Timeline.timestamp, Timeline.message_id,
+                           app.config['MESSAGES_PER_PAGE'])
 
-        return render_template('home.html', messages=messages)
+        return render_template('home.html', messages=page.items,
+                               next_cursor=page.next_cursor,
+                               liked_ids=liked_ids(page.items))
 
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+# Warmup: compile templates and open DB connections before taking traffic
 
+if app.config['WARMUP']:
+    warmup.warm(app)
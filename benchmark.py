@@ -0,0 +1,302 @@
+"""End-to-end route benchmarks for Warbler.
+
+Seeds a throwaway database with generated data (generator/create_csvs.py,
+then seed.py), drives each route through the Flask test client, and
+writes a JSON report of latency, SQL statements and rows fetched per
+route:
+
+    python benchmark.py --database-url postgresql:///warbler-bench \\
+        --users 10000 --messages 50000 --follows 200000 --out bench.json
+
+Reports from two commits can be diffed directly, or pass --baseline to
+have this fail (exit 1) when a route runs more statements than before or
+its p95 grows past --tolerance.
+
+The report also records startup: how long a fresh interpreter takes to
+import app.py and to serve its first and second requests, once cold (no
+template bytecode cache, no warmup) and once warm (a filled bytecode
+cache and WARMUP=1).
+
+The target database is dropped and recreated: never point this at data
+you want to keep.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of `samples` (0 < p <= 100)."""
+
+    ordered = sorted(samples)
+    return ordered[max(0, -(-len(ordered) * p // 100) - 1)]
+
+
+def seed(database_url, opts):
+    """Generate a dataset and load it into `database_url`."""
+
+    env = dict(os.environ, DATABASE_URL=database_url)
+    with tempfile.TemporaryDirectory() as data_dir:
+        subprocess.run(
+            [sys.executable, os.path.join(HERE, 'generator', 'create_csvs.py'),
+             '--out', data_dir, '--seed', opts.seed,
+             '--users', str(opts.users), '--messages', str(opts.messages),
+             '--follows', str(opts.follows), '--likes', str(opts.likes)],
+            check=True, stdout=subprocess.DEVNULL)
+        subprocess.run(
+            [sys.executable, os.path.join(HERE, 'seed.py'), '--data-dir', data_dir],
+            check=True, stdout=subprocess.DEVNULL, env=env, cwd=HERE)
+
+
+@contextmanager
+def sql_activity(engine):
+    """Count statements and (where the driver reports it) rows in the block."""
+
+    from sqlalchemy import event
+
+    stats = {'statements': 0, 'rows': 0}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        stats['statements'] += 1
+        # psycopg2 reports rows for SELECTs too; sqlite3 reports -1
+        if stats['rows'] is not None:
+            stats['rows'] = stats['rows'] + cursor.rowcount if cursor.rowcount >= 0 else None
+
+    event.listen(engine, 'after_cursor_execute', record)
+    try:
+        yield stats
+    finally:
+        event.remove(engine, 'after_cursor_execute', record)
+
+
+def routes(viewer, subject, message):
+    """(name, method, url or url factory) for every route under test.
+
+    Write routes get a factory so each iteration acts on a fresh target.
+    """
+
+    from app import db
+    from models import Message
+
+    def new_message():
+        msg = Message(text='benchmark', user_id=viewer)
+        db.session.add(msg)
+        db.session.commit()
+        return f'/messages/{msg.id}/delete'
+
+    return [
+        ('home', 'GET', '/'),
+        ('users', 'GET', '/users'),
+        ('users_search', 'GET', '/users?q=an'),
+        ('users_show', 'GET', f'/users/{subject}'),
+        ('following', 'GET', f'/users/{viewer}/following'),
+        ('followers', 'GET', f'/users/{subject}/followers'),
+        ('likes', 'GET', f'/users/{viewer}/likes'),
+        ('messages_show', 'GET', f'/messages/{message}'),
+        ('api_timeline', 'GET', '/api/v1/timeline'),
+        ('api_users_show', 'GET', f'/api/v1/users/{subject}'),
+        ('messages_add', 'POST', '/messages/new'),
+        # alternates like and unlike
+        ('messages_like', 'POST', f'/messages/{message}/like'),
+        ('messages_destroy', 'POST', new_message),
+    ]
+
+
+def run(opts):
+    from app import app, db, CURR_USER_KEY
+    from models import User, Message
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+
+    with app.app_context():
+        subject = User.query.order_by(User.follower_count.desc(), User.id).first().id
+        # someone else, so they can like the subject's message
+        viewer = (User.query
+                  .filter(User.id != subject)
+                  .order_by(User.following_count.desc(), User.id)
+                  .first()
+                  .id)
+        message = (Message.query
+                   .filter_by(user_id=subject)
+                   .order_by(Message.timestamp.desc())
+                   .first()
+                   .id)
+        engine = db.engine
+
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = viewer
+
+    results = {}
+    for name, method, target in routes(viewer, subject, message):
+        latencies, statements, rows = [], [], []
+
+        for i in range(opts.warmup + opts.iterations):
+            with app.app_context():
+                url = target() if callable(target) else target
+
+            data = {'text': 'benchmark'} if method == 'POST' else None
+            with sql_activity(engine) as stats:
+                start = time.perf_counter()
+                resp = client.open(url, method=method, data=data)
+                elapsed = time.perf_counter() - start
+
+            if resp.status_code >= 400:
+                raise SystemExit(f"{name}: {method} {url} returned {resp.status_code}")
+
+            if i >= opts.warmup:
+                latencies.append(elapsed * 1000)
+                statements.append(stats['statements'])
+                rows.append(stats['rows'])
+
+        results[name] = {
+            'method': method,
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'statements': max(statements),
+            'rows': None if None in rows else max(rows),
+        }
+        print(f"{name:18} p50 {results[name]['p50_ms']:8.2f} ms  "
+              f"p95 {results[name]['p95_ms']:8.2f} ms  "
+              f"{results[name]['statements']:3d} statements")
+
+    return results
+
+
+def regressions(report, baseline, tolerance):
+    """Routes that got worse than in `baseline`, with the reason."""
+
+    found = {}
+    for name, now in report['routes'].items():
+        before = baseline['routes'].get(name)
+        if before is None:
+            continue
+        if now['statements'] > before['statements']:
+            found[name] = f"statements {before['statements']} -> {now['statements']}"
+        elif now['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            found[name] = f"p95 {before['p95_ms']} -> {now['p95_ms']} ms"
+    return found
+
+
+def probe_startup():
+    """Time importing the app and its first requests; print them as JSON.
+
+    Run in a fresh interpreter by `startup()`.
+    """
+
+    start = time.perf_counter()
+    from app import app
+    imported = time.perf_counter()
+
+    client = app.test_client()
+    timings = {'import_ms': round((imported - start) * 1000, 3)}
+    for name in ('first_request_ms', 'second_request_ms'):
+        before = time.perf_counter()
+        resp = client.get('/users')
+        timings[name] = round((time.perf_counter() - before) * 1000, 3)
+        if resp.status_code != 200:
+            raise SystemExit(f"startup probe: GET /users returned {resp.status_code}")
+    print(json.dumps(timings))
+
+
+def startup(database_url, runs):
+    """Median startup timings, cold and warm, over `runs` fresh interpreters."""
+
+    def probe(warm, cache_dir):
+        env = dict(os.environ, DATABASE_URL=database_url, HASH_WORKERS='0',
+                   WARMUP='1' if warm else '0', TEMPLATE_CACHE_DIR=cache_dir)
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--probe-startup'],
+                             check=True, capture_output=True, text=True, env=env, cwd=HERE)
+        return json.loads(out.stdout.splitlines()[-1])
+
+    results = {}
+    with tempfile.TemporaryDirectory() as warm_dir:
+        # fill the bytecode cache, as a deploy's `flask warmup` would
+        probe(True, warm_dir)
+
+        for mode in ('cold', 'warm'):
+            samples = []
+            for _ in range(runs):
+                if mode == 'cold':
+                    with tempfile.TemporaryDirectory() as cold_dir:
+                        samples.append(probe(False, cold_dir))
+                else:
+                    samples.append(probe(True, warm_dir))
+            results[mode] = {k: percentile([s[k] for s in samples], 50) for k in samples[0]}
+            print(f"startup {mode:5} import {results[mode]['import_ms']:8.2f} ms  "
+                  f"first request {results[mode]['first_request_ms']:8.2f} ms  "
+                  f"second {results[mode]['second_request_ms']:8.2f} ms")
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default='postgresql:///warbler-bench')
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=5000)
+    parser.add_argument('--likes', type=int, default=3000)
+    parser.add_argument('--seed', default='warbler')
+    parser.add_argument('--no-seed', action='store_true',
+                        help="reuse the data already in the database")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--out', default='benchmark.json')
+    parser.add_argument('--baseline', help="earlier report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed p95 growth over the baseline (0.25 = 25%%)")
+    parser.add_argument('--startup-runs', type=int, default=3)
+    parser.add_argument('--probe-startup', action='store_true', help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+
+    if opts.probe_startup:
+        probe_startup()
+        return
+
+    if not opts.no_seed:
+        seed(opts.database_url, opts)
+
+    # app.py reads its database from the environment at import time
+    os.environ['DATABASE_URL'] = opts.database_url
+    os.environ.setdefault('HASH_WORKERS', '0')
+
+    report = {
+        'commit': git_commit(),
+        'dataset': {k: getattr(opts, k) for k in ('users', 'messages', 'follows', 'likes', 'seed')},
+        'iterations': opts.iterations,
+        'routes': run(opts),
+        'startup': startup(opts.database_url, opts.startup_runs),
+    }
+
+    with open(opts.out, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Wrote {opts.out}")
+
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            worse = regressions(report, json.load(f), opts.tolerance)
+        for name, reason in worse.items():
+            print(f"REGRESSION {name}: {reason}", file=sys.stderr)
+        if worse:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Flask CLI commands for managing the Warbler database.
+
+Run these with the app on FLASK_APP, e.g.:
+
+    FLASK_APP=app flask migrate
+"""
+
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from models import db, User
+import hashing
+import jobs
+import migrations
+import partitions
+import query_plans
+import warmup
+
+
+@click.command('migrate')
+@with_appcontext
+def migrate_command():
+    """Apply pending schema migrations."""
+
+    applied = migrations.upgrade(db.engine)
+    for m in applied:
+        click.echo(f"Applied {m.version}: {m.description}")
+    if not applied:
+        click.echo("Database is up to date.")
+
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans_command():
+    """EXPLAIN each route's query; fail if any needs a full table scan."""
+
+    failures = query_plans.find_seq_scans()
+    for route, tables in failures.items():
+        click.echo(f"{route}: sequential scan on {', '.join(tables)}", err=True)
+    if failures:
+        raise SystemExit(1)
+    click.echo("All route queries use indexes.")
+
+
+@click.command('repair-counters')
+@with_appcontext
+def repair_counters_command():
+    """Recompute every user's message/follower/following/like counters."""
+
+    User.repair_counters()
+    db.session.commit()
+    click.echo("Counters repaired.")
+
+
+@click.command('calibrate-bcrypt')
+@click.option('--target-ms', default=250, show_default=True,
+              help="Hash latency to aim for, in milliseconds.")
+def calibrate_bcrypt_command(target_ms):
+    """Benchmark bcrypt here and suggest a BCRYPT_LOG_ROUNDS."""
+
+    rounds, timings = hashing.calibrate(target_ms)
+    for r, ms in timings.items():
+        click.echo(f"rounds={r:2d}  {ms:8.1f} ms")
+    click.echo(f"BCRYPT_LOG_ROUNDS={rounds}")
+    click.echo("Existing passwords are re-hashed at this cost as users log in.")
+
+
+@click.command('warmup')
+@with_appcontext
+def warmup_command():
+    """Compile every template into the bytecode cache and test the pool."""
+
+    stats = warmup.warm(current_app)
+    click.echo(f"Compiled {stats['templates']} templates in {stats['templates_ms']} ms; "
+               f"opened {stats['connections']} connections in {stats['connections_ms']} ms.")
+
+
+@click.command('worker')
+@click.option('--threads', default=2, show_default=True)
+@click.option('--burst', is_flag=True, help="Run the jobs that are due, then exit.")
+@with_appcontext
+def worker_command(threads, burst):
+    """Run queued background jobs."""
+
+    app = current_app._get_current_object()
+    if burst:
+        click.echo(f"Ran {jobs.work(app)} jobs.")
+        return
+
+    pool = jobs.WorkerPool(app, threads)
+    pool.start()
+    click.echo(f"Running jobs on {threads} threads; Ctrl-C to stop.")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pool.stop()
+
+
+@click.command('partition-messages')
+@click.option('--ahead', default=partitions.MONTHS_AHEAD, show_default=True,
+              help="Months past this one to have partitions for.")
+@click.option('--archive-before', type=click.DateTime(formats=['%Y-%m']),
+              help="Detach the partitions of months before this one (YYYY-MM).")
+@with_appcontext
+def partition_messages_command(ahead, archive_before):
+    """Add upcoming monthly message partitions; detach old ones."""
+
+    with db.engine.begin() as connection:
+        if not partitions.supported(connection) or not partitions.is_partitioned(connection):
+            click.echo("Messages aren't partitioned here (Postgres only; run `flask migrate`).")
+            return
+
+        for name in partitions.ensure_partitions(connection, ahead):
+            click.echo(f"Created {name}")
+        if archive_before:
+            for name in partitions.archive_partitions(connection, archive_before):
+                click.echo(f"Detached {name}; dump and drop it to archive.")
+
+
+def register_commands(app):
+    """Add Warbler's management commands to `app.cli`."""
+
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(check_query_plans_command)
+    app.cli.add_command(repair_counters_command)
+    app.cli.add_command(calibrate_bcrypt_command)
+    app.cli.add_command(warmup_command)
+    app.cli.add_command(worker_command)
+    app.cli.add_command(partition_messages_command)
@@ -0,0 +1,191 @@
+"""Connection pool settings and metrics for the SQLAlchemy engine.
+
+`engine_options()` turns the DB_* settings into create_engine() options.
+PooledSQLAlchemy applies them to each engine Flask-SQLAlchemy creates,
+which means the primary and every bind, according to that engine's own URL:
+
+    DB_POOL_SIZE            connections kept open per process (5)
+    DB_MAX_OVERFLOW         extra connections allowed under bursts (10)
+    DB_POOL_TIMEOUT         seconds to wait for a free connection (10)
+    DB_POOL_RECYCLE         seconds before a connection is replaced (1800)
+    DB_POOL_PRE_PING        test connections on checkout (on)
+    DB_CONNECT_TIMEOUT      seconds to wait for Postgres to accept (5)
+    DB_STATEMENT_TIMEOUT    per-statement limit in ms; 0 for none (0)
+
+A process holds at most DB_POOL_SIZE + DB_MAX_OVERFLOW connections, so
+workers x that must stay under Postgres' max_connections. Pre-ping and
+recycling drop connections a failover left dead instead of handing them
+to a request. The pool is LIFO, so connections left over from a burst sit
+idle until recycled rather than being kept warm in rotation.
+
+SQLite has no server-side pool to size, so it keeps Flask-SQLAlchemy's
+defaults, and only Postgres URLs get psycopg2's connect_args. Anything
+set in SQLALCHEMY_ENGINE_OPTIONS still overrides these, for every engine.
+
+The pool records checkouts, waits, timeouts and reconnects; /metrics/pool
+serves them along with how many connections are in use now, to right-size
+pools against max_connections.
+"""
+
+import threading
+import time
+
+from flask import jsonify
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    """Thread-safe totals for every MeteredQueuePool in the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.checkouts = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+            self.checked_out = 0
+            self.peak_checked_out = 0
+
+    def waited(self, seconds, timed_out=False):
+        with self._lock:
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def checked(self, delta):
+        with self._lock:
+            self.checked_out += delta
+            if delta > 0:
+                self.checkouts += 1
+                self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_ms': round(self.wait_seconds * 1000, 3),
+                'max_wait_ms': round(self.max_wait_seconds * 1000, 3),
+                'avg_wait_ms': round(self.wait_seconds * 1000 / (self.checkouts or 1), 3),
+                'peak_checked_out': self.peak_checked_out,
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waits.
+
+    The wait covers queueing for a returned connection and opening a new
+    one when the pool has room.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            pool_metrics.waited(time.perf_counter() - start, timed_out)
+
+
+@event.listens_for(MeteredQueuePool, 'checkout')
+def _checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_metrics.checked(1)
+
+
+@event.listens_for(MeteredQueuePool, 'checkin')
+def _checkin(dbapi_connection, connection_record):
+    # a connection invalidated while checked out is checked in with None
+    pool_metrics.checked(-1)
+
+
+@event.listens_for(MeteredQueuePool, 'connect')
+def _connect(dbapi_connection, connection_record):
+    pool_metrics.count('connects')
+
+
+@event.listens_for(MeteredQueuePool, 'invalidate')
+def _invalidate(dbapi_connection, connection_record, exception):
+    pool_metrics.count('invalidations')
+
+
+def engine_options(config, url=None):
+    """create_engine() options for `url` (by default, `config`'s database)."""
+
+    url = make_url(url or config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite':
+        return {}
+
+    options = {
+        'poolclass': MeteredQueuePool,
+        'pool_size': config.get('DB_POOL_SIZE', 5),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 10),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+        'pool_use_lifo': True,
+    }
+
+    if url.get_backend_name() == 'postgresql':
+        connect_args = {'connect_timeout': config.get('DB_CONNECT_TIMEOUT', 5)}
+        statement_timeout = config.get('DB_STATEMENT_TIMEOUT', 0)
+        if statement_timeout:
+            connect_args['options'] = f'-c statement_timeout={int(statement_timeout)}'
+        options['connect_args'] = connect_args
+
+    return options
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy that sizes each engine's pool for its own database."""
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        rv = super().apply_driver_hacks(app, sa_url, options)
+        options.update(engine_options(app.config, sa_url))
+        return rv
+
+
+def pool_status(pool):
+    """The pool's current occupancy, plus the process-wide totals."""
+
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'max_overflow': pool._max_overflow,
+            'checked_out': pool.checkedout(),
+            'idle': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+        })
+        status['utilization'] = round(
+            status['checked_out'] / (status['size'] + status['max_overflow']), 3)
+    status.update(pool_metrics.snapshot())
+    return status
+
+
+def init_app(app, db):
+    """Serve `db`'s pool status at /metrics/pool."""
+
+    app.add_url_rule('/metrics/pool', 'pool_metrics',
+                     lambda: jsonify(pool_status(db.engine.pool)))
@@ -0,0 +1,140 @@
+"""Fragment cache for rendered message and user cards.
+
+Listings render the same card markup for the same message or user on
+every request. Templates wrap the viewer-independent part of a card in
+
+    {% call message_card(msg, 'home') %} ... {% endcall %}
+
+or `user_card(user, 'index')`, and the rendered HTML is kept under a key
+made of the card kind, the template variant, the row's id and the row's
+version. Anything that depends on the viewer (like and follow buttons)
+stays outside the call block.
+
+Versions are opaque tokens kept in the same backend. `invalidate_*()`
+drops a row's token, so the next render makes a new one and every old
+fragment for that row stops matching and ages out of the LRU. A token
+lost to eviction behaves the same way, so eviction can never bring back
+stale markup. Message cards also carry their author's token, since they
+show the author's name and avatar. Keys include the templates digest, so
+a deploy that edits a card never serves the old markup.
+
+The default backend is a per-process LRU. Anything with get/set/delete/clear
+(say, an adapter over a shared memcached) can be passed instead, and then
+an invalidation reaches every worker at once.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+import http_cache
+
+
+class LRUBackend:
+    """Thread-safe in-process LRU of strings."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FragmentCache:
+    """Rendered card fragments, versioned per message and per user."""
+
+    def __init__(self, maxsize=10000, backend=None):
+        self.backend = backend if backend is not None else LRUBackend(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _prefix(self):
+        return (http_cache.templates_digest() or '')[:12]
+
+    def version(self, kind, row_id):
+        """Current version token of a message or user, made on first use."""
+
+        key = f'{self._prefix()}:v:{kind}:{row_id}'
+        token = self.backend.get(key)
+        if token is None:
+            token = os.urandom(6).hex()
+            self.backend.set(key, token)
+        return token
+
+    def fragment(self, key, render):
+        """Cached HTML for `key`, rendering (and caching) it on a miss."""
+
+        html = self.backend.get(key)
+        hit = html is not None
+        if not hit:
+            html = str(render())
+            self.backend.set(key, html)
+
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return Markup(html)
+
+    def message_card(self, msg, variant, caller):
+        """Template call block: the card for Message `msg`."""
+
+        key = (f'{self._prefix()}:message:{variant}:{msg.id}'
+               f':{self.version("message", msg.id)}'
+               f':{self.version("user", msg.user_id)}')
+        return self.fragment(key, caller)
+
+    def user_card(self, user, variant, caller):
+        """Template call block: the card for User `user`."""
+
+        key = f'{self._prefix()}:user:{variant}:{user.id}:{self.version("user", user.id)}'
+        return self.fragment(key, caller)
+
+    def invalidate_message(self, message_id):
+        """Forget the cards of a changed or deleted message."""
+
+        self.backend.delete(f'{self._prefix()}:v:message:{message_id}')
+
+    def invalidate_user(self, user_id):
+        """Forget the cards of a user and of all their messages."""
+
+        self.backend.delete(f'{self._prefix()}:v:user:{user_id}')
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def init_app(self, app):
+        """Make the card call blocks available to `app`'s templates."""
+
+        app.add_template_global(self.message_card, 'message_card')
+        app.add_template_global(self.user_card, 'user_card')
@@ -2,76 +2,175 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. for benchmarking:
+
+    python generator/create_csvs.py --users 10000000 --messages 50000000 \\
+        --follows 200000000 --likes 100000000 --workers 8 --out /data/warbler
+
+Nothing here touches the network. Rows are generated in fixed-size chunks
+and streamed to disk, so memory stays flat at any scale. Each chunk gets
+its own random generator seeded from --seed and the chunk's position, so
+the same arguments always produce the same files, whatever --workers is.
+
+Followers and likes follow a power law (see helpers.PowerLaw): a handful
+of users have huge followings and a handful of messages most of the likes,
+as on a real site.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import random
+from datetime import datetime
+from multiprocessing import Pool
+
 from faker import Faker
-from helpers import get_random_datetime
+from helpers import HEADER_IMAGE_URLS, PROFILE_IMAGE_URLS, PowerLaw, get_random_datetime
 
 MAX_WARBLER_LENGTH = 140
 
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
+
+# every sample user's password is "password"
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+CHUNK_SIZE = 10000
+
+
+def distinct_draws(rng, dist, count, exclude=None):
+    """`count` distinct ids from `dist`, never `exclude`, in order."""
+
+    population = dist.n - (exclude is not None)
+    count = min(count, population)
+
+    if count > population // 2:
+        # rejection sampling would crawl; just pick uniformly
+        ids = [i for i in range(1, dist.n + 1) if i != exclude]
+        return sorted(rng.sample(ids, count))
+
+    picked = set()
+    while len(picked) < count:
+        i = dist.draw(rng)
+        if i != exclude:
+            picked.add(i)
+    return sorted(picked)
+
+
+def degree(i, total, n):
+    """How many of `total` rows belong to the i-th of `n` owners (1-based)."""
+
+    base, extra = divmod(total, n)
+    return base + (i <= extra)
+
+
+def users_chunk(rng, fake, start, stop, opts):
+    for user_id in range(start + 1, stop + 1):
+        # the id suffix keeps usernames unique at any scale
+        username = f"{fake.user_name()}{user_id}"
+        yield [f"{username}@{fake.free_email_domain()}",
+               username,
+               rng.choice(PROFILE_IMAGE_URLS),
+               PASSWORD_HASH,
+               fake.sentence(),
+               rng.choice(HEADER_IMAGE_URLS),
+               fake.city()]
+
+
+def messages_chunk(rng, fake, start, stop, opts):
+    # prolific authors aren't necessarily the most followed users
+    authors = PowerLaw(opts['users'], opts['alpha'], offset=opts['users'] // 2)
+    for _ in range(start, stop):
+        yield [fake.paragraph()[:MAX_WARBLER_LENGTH],
+               get_random_datetime(rng, opts['end']),
+               authors.draw(rng)]
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
 
-fake = Faker()
+def follows_chunk(rng, fake, start, stop, opts):
+    # rows are generated per follower, so pairs can't repeat across chunks
+    followed = PowerLaw(opts['users'], opts['alpha'])
+    for follower in range(start + 1, stop + 1):
+        count = degree(follower, opts['follows'], opts['users'])
+        for user_id in distinct_draws(rng, followed, count, exclude=follower):
+            yield [user_id, follower]
 
-# Generate random profile image URLs to use for users
 
-image_urls = [
-    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
-    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
-    for i in range(count)
-]
+def likes_chunk(rng, fake, start, stop, opts):
+    liked = PowerLaw(opts['messages'], opts['alpha'])
+    for user_id in range(start + 1, stop + 1):
+        count = degree(user_id, opts['likes'], opts['users'])
+        for message_id in distinct_draws(rng, liked, count):
+            yield [user_id, message_id]
 
-# Generate random header image URLs to use for users
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
+TABLES = {
+    'users': (USERS_CSV_HEADERS, users_chunk, 'users'),
+    'messages': (MESSAGES_CSV_HEADERS, messages_chunk, 'messages'),
+    # follows and likes are chunked by the user they belong to
+    'follows': (FOLLOWS_CSV_HEADERS, follows_chunk, 'users'),
+    'likes': (LIKES_CSV_HEADERS, likes_chunk, 'users'),
+}
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
 
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
+def generate_chunk(job):
+    """Rows for one chunk of a table; runs in a worker process."""
 
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
+    table, start, stop, opts = job
+    seed = f"{opts['seed']}:{table}:{start}"
 
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
+    rng = random.Random(seed)
+    fake = Faker()
+    fake.seed_instance(seed)
 
-# Generate follows.csv from random pairings of users
+    return list(TABLES[table][1](rng, fake, start, stop, opts))
 
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
 
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
+def write_csv(table, opts, pool=None):
+    headers, _, chunked_by = TABLES[table]
+    total = opts[chunked_by] if opts[table] else 0
 
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+    jobs = [(table, start, min(start + CHUNK_SIZE, total), opts)
+            for start in range(0, total, CHUNK_SIZE)]
+    chunks = pool.imap(generate_chunk, jobs) if pool else map(generate_chunk, jobs)
+
+    path = os.path.join(opts['out'], f'{table}.csv')
+    rows = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            rows += len(chunk)
+
+    print(f"{path}: {rows} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=5000)
+    parser.add_argument('--likes', type=int, default=3000)
+    parser.add_argument('--alpha', type=float, default=1.2,
+                        help="power-law exponent for followers, likes and authors")
+    parser.add_argument('--seed', default='warbler')
+    parser.add_argument('--end', type=datetime.fromisoformat, default=datetime(2020, 1, 1),
+                        help="latest message timestamp")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="processes to generate with (default: this one)")
+    parser.add_argument('--out', default=os.path.dirname(os.path.abspath(__file__)))
+    opts = vars(parser.parse_args())
+
+    if opts['workers']:
+        with Pool(opts['workers']) as pool:
+            for table in TABLES:
+                write_csv(table, opts, pool)
+    else:
+        for table in TABLES:
+            write_csv(table, opts)
+
+
+if __name__ == '__main__':
+    main()
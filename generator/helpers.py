@@ -1,14 +1,105 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+from datetime import timedelta
+from math import gcd
 
+# Splashbase header images, listed here so generating data needs no network.
+HEADER_IMAGE_URLS = [
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/" + name
+    for name in [
+        'tumblr_mnh0n9pHJW1st5lhmo1_1280.jpg',
+        'tumblr_mnh0uemhCk1st5lhmo1_1280.jpg',
+        'tumblr_mnh121HEWa1st5lhmo1_1280.jpg',
+        'tumblr_mnh17lfd9R1st5lhmo1_1280.jpg',
+        'tumblr_mnh1d7s3UD1st5lhmo1_1280.jpg',
+        'tumblr_mnh1jdFvHR1st5lhmo1_1280.jpg',
+        'tumblr_mnh1uhYnog1st5lhmo1_1280.jpg',
+        'tumblr_mnh25vNOvI1st5lhmo1_1280.jpg',
+        'tumblr_mnh29fxz111st5lhmo1_1280.jpg',
+        'tumblr_mnh2m1hnS81st5lhmo1_1280.jpg',
+        'tumblr_mo1h6tGOZf1st5lhmo1_1280.jpg',
+        'tumblr_mo2wz2LTCs1st5lhmo1_1280.jpg',
+        'tumblr_mo2x3aAnRH1st5lhmo1_1280.jpg',
+        'tumblr_mo2x80NkDu1st5lhmo1_1280.jpg',
+        'tumblr_mo2x9xqeef1st5lhmo1_1280.jpg',
+        'tumblr_mo2xbk8JUK1st5lhmo1_1280.jpg',
+        'tumblr_mo2xdqmle51st5lhmo1_1280.jpg',
+        'tumblr_mo2xfarCvW1st5lhmo1_1280.jpg',
+        'tumblr_mo2xgqdEFn1st5lhmo1_1280.jpg',
+        'tumblr_mo2xijE2nr1st5lhmo1_1280.jpg',
+        'tumblr_mopq4kHmAg1st5lhmo1_1280.jpg',
+        'tumblr_mopq69jlcS1st5lhmo1_1280.jpg',
+        'tumblr_mopq8fyQwI1st5lhmo1_1280.jpg',
+        'tumblr_mopqamedKu1st5lhmo1_1280.jpg',
+        'tumblr_mopqc3ZZcz1st5lhmo1_1280.jpg',
+        'tumblr_mopqdfx05t1st5lhmo1_1280.jpg',
+        'tumblr_mopqfpSTPN1st5lhmo1_1280.jpg',
+        'tumblr_mopqhxFulr1st5lhmo1_1280.jpg',
+        'tumblr_mopqj9QUeq1st5lhmo1_1280.jpg',
+        'tumblr_mopqkkwK2M1st5lhmo1_1280.jpg',
+        'tumblr_mp6rzyNlAN1st5lhmo1_1280.jpg',
+        'tumblr_mp6s1hAudo1st5lhmo1_1280.jpg',
+        'tumblr_mp6s32zb6l1st5lhmo1_1280.jpg',
+        'tumblr_mp6s4dzqHA1st5lhmo1_1280.jpg',
+        'tumblr_mp6s661UgK1st5lhmo1_1280.jpg',
+        'tumblr_mp6s7lR1lS1st5lhmo1_1280.jpg',
+        'tumblr_mp6s995bvI1st5lhmo1_1280.jpg',
+        'tumblr_mp6sasSvPZ1st5lhmo1_1280.jpg',
+        'tumblr_mp6scv2xrZ1st5lhmo1_1280.jpg',
+        'tumblr_mpp6f50W261st5lhmo1_1280.jpg',
+        'tumblr_mpp6gwrYvm1st5lhmo1_1280.jpg',
+        'tumblr_mpp6l06zXi1st5lhmo1_1280.jpg',
+        'tumblr_mpp6poZxE51st5lhmo1_1280.jpg',
+        'tumblr_mpp6tjdFhf1st5lhmo1_1280.jpg',
+        'tumblr_mpp6w0dxAm1st5lhmo1_1280.jpg',
+    ]
+]
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+PROFILE_IMAGE_URLS = [
+    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
+    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
+    for i in range(count)
+]
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
 
-    return datetime.fromtimestamp(random_timestamp)
+def get_random_datetime(rng, end, year_gap=2):
+    """Get a random datetime within the `year_gap` years before `end`."""
+
+    then = end.replace(year=end.year - year_gap)
+    return then + timedelta(seconds=rng.uniform(0, (end - then).total_seconds()))
+
+
+class PowerLaw:
+    """Draw ids 1..n so that a few are very popular and most are not.
+
+    The k-th most popular id is drawn with probability proportional to
+    k ** -alpha (alpha > 1 gives a heavier head). Sampling inverts the
+    continuous CDF, so it's O(1) per draw and needs no per-id table even
+    for millions of ids. Popularity ranks are scattered over the ids by a
+    fixed stride, so the popular users aren't simply the first ones;
+    different `offset`s give unrelated popularity orders over the same ids.
+    """
+
+    def __init__(self, n, alpha=1.2, offset=0):
+        if alpha == 1:
+            raise ValueError("alpha must not be 1")
+
+        self.n = n
+        self.exponent = 1 - alpha
+        self.span = n ** self.exponent - 1
+        self.offset = offset
+
+        self.stride = 7919
+        while gcd(self.stride, n) != 1:
+            self.stride += 2
+
+    def rank(self, rng):
+        """A popularity rank in 1..n (1 is the most popular)."""
+
+        x = (self.span * rng.random() + 1) ** (1 / self.exponent)
+        return min(int(x), self.n)
+
+    def draw(self, rng):
+        """A random id in 1..n."""
+
+        return ((self.rank(rng) - 1) * self.stride + self.offset) % self.n + 1
@@ -0,0 +1,150 @@
+"""Password hashing off the request threads.
+
+bcrypt is deliberately slow, so hashing on a request thread ties that
+thread up for the whole hash; a burst of logins can occupy every worker.
+PasswordHasher runs hashes in a dedicated process pool sized to the
+host's cores, and refuses new work with HashingBusy once too many hashes
+are already waiting, so the app can answer 503 straight away instead of
+queueing logins behind each other.
+
+This module must stay importable on its own: pool processes are spawned
+and import only this file.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import bcrypt
+
+
+class HashingBusy(Exception):
+    """Raised when the hash queue is full; the caller should retry later."""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('UTF-8'), bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def _check(pw_hash, password):
+    return bcrypt.checkpw(password.encode('UTF-8'), pw_hash.encode('UTF-8'))
+
+
+def cost_of(pw_hash):
+    """The work factor a bcrypt hash was made at, e.g. 12 for $2b$12$..."""
+
+    return int(pw_hash.split('$')[2])
+
+
+def calibrate(target_ms=250, min_rounds=4, max_rounds=16):
+    """Find the highest work factor that hashes within `target_ms` here.
+
+    Each extra round doubles the cost, so this times successive rounds on
+    the current host and stops at the first one over the target. Returns
+    (rounds, {rounds: milliseconds}).
+    """
+
+    timings = {}
+    best = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        start = time.perf_counter()
+        _hash('calibration-password', rounds)
+        timings[rounds] = (time.perf_counter() - start) * 1000
+
+        if timings[rounds] > target_ms:
+            break
+        best = rounds
+
+    return best, timings
+
+
+class PasswordHasher:
+    """Bounded bcrypt worker pool, configured from the Flask app.
+
+    Config keys:
+
+    - BCRYPT_LOG_ROUNDS: work factor for new hashes (default 12)
+    - HASH_WORKERS: pool processes (default: CPU count); 0 hashes inline
+      on the calling thread, which is handy in tests
+    - HASH_MAX_PENDING: hashes allowed in flight or queued before new
+      ones are refused (default: 2 per worker)
+    - HASH_TIMEOUT: seconds to wait for a queued hash (default 10)
+    """
+
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.workers = os.cpu_count() or 1
+        self.max_pending = 2 * self.workers
+        self.timeout = 10
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.rounds = app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        self.workers = app.config.setdefault('HASH_WORKERS', os.cpu_count() or 1)
+        self.max_pending = app.config.setdefault('HASH_MAX_PENDING', 2 * max(self.workers, 1))
+        self.timeout = app.config.setdefault('HASH_TIMEOUT', 10)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def generate_password_hash(self, password, rounds=None):
+        """Hash `password` at `rounds` (default: the configured work factor)."""
+
+        if not password:
+            raise ValueError('Password must be non-empty.')
+
+        return self._run(_hash, password, rounds or self.rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        """Does `password` match `pw_hash`?"""
+
+        if not pw_hash or not password:
+            return False
+
+        return self._run(_check, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made at a work factor other than the configured one?"""
+
+        return cost_of(pw_hash) != self.rounds
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+
+        if not self.workers:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+
+        try:
+            future = self._executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+
+        # the slot stays taken until the pool is actually done with it
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HashingBusy()
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._pool
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,121 @@
+"""HTTP caching for Warbler pages and static files.
+
+Pages: routes whose content is determined by a few rows build an ETag
+and Last-Modified from those rows' timestamps (plus the viewer's, since
+the nav bar, follow buttons and like buttons depend on them) and call
+`conditional()`. A browser revalidating with If-None-Match or
+If-Modified-Since gets a 304 before the template is rendered. Pages are
+per viewer, so they're `private` and revalidated on every view.
+
+Static files: templates link them through `static_url()`, which adds a
+content hash to the URL. A versioned URL can never change, so it's served
+as immutable for a year; unversioned ones (e.g. default avatars stored in
+the users table) get SEND_FILE_MAX_AGE_DEFAULT.
+"""
+
+import hashlib
+import os
+
+from flask import current_app, g, make_response, request, session, url_for
+from werkzeug.http import is_resource_modified
+
+from models import db, User
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# responses that don't set their own Cache-Control
+DEFAULT_CACHE_CONTROL = 'private, no-cache'
+
+_static_versions = {}
+_templates_digest = None
+
+
+def _digest_files(root):
+    h = hashlib.sha1()
+    for dirpath, dirnames, filenames in sorted(os.walk(root)):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            h.update(path.encode('UTF-8'))
+            with open(path, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def templates_digest():
+    """Digest of the app's templates; changes whenever one is edited."""
+
+    return _templates_digest
+
+
+def static_url(filename):
+    """URL for a static file, versioned by its content."""
+
+    version = _static_versions.get(filename)
+    if version is None:
+        with open(os.path.join(current_app.static_folder, filename), 'rb') as f:
+            version = hashlib.sha1(f.read()).hexdigest()[:12]
+        _static_versions[filename] = version
+    return url_for('static', filename=filename, v=version)
+
+
+def viewer_updated_at():
+    """The logged-in user's updated_at (None when logged out)."""
+
+    if g.user is None:
+        return None
+    # not from g.user: its cached snapshot doesn't track follows and likes
+    return (db.session
+            .query(User.updated_at)
+            .filter(User.id == g.user.id)
+            .scalar())
+
+
+def conditional(render, *versions):
+    """Answer with a 304 if the client's copy is current, else `render()`.
+
+    `versions` are what the page's content depends on: ids and
+    timestamps of the rows it shows. Datetimes among them (and the
+    viewer's updated_at) also give the Last-Modified.
+    """
+
+    if session.get('_flashes'):
+        # a one-off message is waiting to be shown; don't validate
+        return render()
+
+    viewer_version = viewer_updated_at()
+    parts = [_templates_digest, request.full_path,
+             g.user.id if g.user is not None else None, viewer_version, *versions]
+    etag = hashlib.sha1(repr(parts).encode('UTF-8')).hexdigest()
+
+    stamps = [v for v in (viewer_version, *versions) if hasattr(v, 'microsecond')]
+    last_modified = max(stamps).replace(microsecond=0) if stamps else None
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+
+def _cache_headers(response):
+    if request.endpoint == 'static':
+        if 'v' in request.args:
+            response.headers['Cache-Control'] = IMMUTABLE
+    elif 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = DEFAULT_CACHE_CONTROL
+    return response
+
+
+def init_app(app):
+    """Set cache headers on `app`'s responses; make static_url available."""
+
+    global _templates_digest
+    _templates_digest = _digest_files(os.path.join(app.root_path, app.template_folder))
+
+    app.add_template_global(static_url)
+    app.after_request(_cache_headers)
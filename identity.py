@@ -0,0 +1,157 @@
+"""Cached identity for the logged-in user.
+
+Every page renders the nav bar from `g.user`, but the nav bar only needs
+the user's id, username and avatar. `g.user` is a CurrentUser that answers
+those from a small snapshot kept in an in-process LRU cache, and only
+loads the full User row when a route actually reads or changes anything
+else. A warm cache means a request that just renders pages for a
+logged-in user skips the users lookup entirely.
+
+Snapshots are per process, so a profile change made through another
+worker shows up here once the snapshot's TTL runs out.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import abort
+
+from models import User
+
+UserSnapshot = namedtuple('UserSnapshot', ['id', 'username', 'image_url'])
+
+
+def snapshot_of(user):
+    """Build the cacheable snapshot of a User."""
+
+    return UserSnapshot(user.id, user.username, user.image_url)
+
+
+class IdentityCache:
+    """Thread-safe LRU of UserSnapshots that expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return the fresh snapshot for `user_id`, or None."""
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] <= self.clock():
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, snapshot):
+        """Cache `snapshot`, evicting the least recently used if full."""
+
+        with self._lock:
+            self._entries[snapshot.id] = (snapshot, self.clock() + self.ttl)
+            self._entries.move_to_end(snapshot.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Forget `user_id`'s snapshot (after a profile change or delete)."""
+
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+class CurrentUser:
+    """Lazy stand-in for the logged-in User, stored on `g.user`.
+
+    `id` comes from the session and `username` and `image_url` from the
+    cached snapshot; any other attribute, method or assignment loads the
+    User row (once per request) and is forwarded to it. A CurrentUser is
+    falsy if the session's user no longer exists.
+    """
+
+    def __init__(self, user_id, cache):
+        object.__setattr__(self, '_user_id', user_id)
+        object.__setattr__(self, '_cache', cache)
+        object.__setattr__(self, '_snap', None)
+        object.__setattr__(self, '_loaded', None)
+        object.__setattr__(self, '_checked', False)
+
+    @property
+    def id(self):
+        # known from the session, so never worth a lookup
+        return self._user_id
+
+    def load(self):
+        """Return the User row for this request, or None if it's gone."""
+
+        if not self._checked:
+            object.__setattr__(self, '_loaded', User.query.get(self._user_id))
+            object.__setattr__(self, '_checked', True)
+        return self._loaded
+
+    # Per-page lookups keyed on the user's id; they don't need the row.
+
+    def is_following(self, other_user):
+        return User.is_following(self, other_user)
+
+    def following_ids(self, user_ids):
+        return User.following_ids(self, user_ids)
+
+    def liked_ids(self, message_ids):
+        return User.liked_ids(self, message_ids)
+
+    def _snapshot(self):
+        if self._snap is None:
+            snapshot = self._cache.get(self._user_id)
+            if snapshot is None:
+                user = self.load()
+                if user is not None:
+                    snapshot = snapshot_of(user)
+                    self._cache.put(snapshot)
+            object.__setattr__(self, '_snap', snapshot)
+        return self._snap
+
+    def _user(self):
+        user = self.load()
+        if user is None:
+            # the snapshot outlived the row (deleted through another worker)
+            self._cache.invalidate(self._user_id)
+            abort(401)
+        return user
+
+    def __bool__(self):
+        return self._snapshot() is not None
+
+    def __getattr__(self, name):
+        if name in UserSnapshot._fields:
+            snapshot = self._snapshot()
+            if snapshot is not None:
+                return getattr(snapshot, name)
+        return getattr(self._user(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._user(), name, value)
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self._user_id
+
+    def __hash__(self):
+        return hash(self._user_id)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self._user_id}>"
@@ -0,0 +1,174 @@
+"""Per-request SQL instrumentation.
+
+Engine events count and time every statement a request runs. Each
+response gets the totals in its headers:
+
+    X-DB-Queries: 3
+    Server-Timing: db;dur=4.2;desc="3 queries"
+
+One structured log line per request goes to the `warbler.sql` logger,
+and /metrics serves per-endpoint aggregates as JSON. The bookkeeping is
+a few counter bumps per statement, so this stays on in production.
+
+Routes can declare how many statements they should need:
+
+    @app.route('/')
+    @query_budget(3)
+    def homepage(): ...
+
+A request over budget logs a warning. With QUERY_BUDGET_STRICT set, as in
+tests, it raises QueryBudgetExceeded instead.
+"""
+
+import json
+import logging
+import threading
+import time
+
+from flask import current_app, g, has_app_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('warbler.sql')
+
+# how much of the slowest statement to keep for logs
+STATEMENT_PREVIEW = 200
+
+
+class QueryBudgetExceeded(Exception):
+    """A request ran more SQL statements than its route's budget."""
+
+
+class RequestStats:
+    """SQL activity for one request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement, seconds):
+        self.queries += 1
+        self.seconds += seconds
+        if seconds > self.slowest:
+            self.slowest = seconds
+            self.slowest_statement = statement[:STATEMENT_PREVIEW]
+
+
+class Metrics:
+    """Thread-safe per-endpoint totals across requests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def add(self, endpoint, stats, over_budget):
+        with self._lock:
+            m = self._endpoints.setdefault(endpoint, dict(
+                requests=0, queries=0, db_ms=0.0, max_queries=0, over_budget=0))
+            m['requests'] += 1
+            m['queries'] += stats.queries
+            m['db_ms'] += stats.seconds * 1000
+            m['max_queries'] = max(m['max_queries'], stats.queries)
+            m['over_budget'] += over_budget
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: dict(m, db_ms=round(m['db_ms'], 3))
+                    for endpoint, m in self._endpoints.items()}
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+metrics = Metrics()
+
+
+def query_budget(max_queries):
+    """Declare the most SQL statements a view should run per request."""
+
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+
+    return decorator
+
+
+def current_stats():
+    """The running RequestStats, or None outside an instrumented request."""
+
+    return g.get('sql_stats') if has_app_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+
+def _start_request():
+    g.sql_stats = RequestStats()
+
+
+def _finish_request(response):
+    stats = g.pop('sql_stats', None)
+    if stats is None:
+        return response
+
+    endpoint = request.endpoint or 'unmatched'
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None)
+    over_budget = budget is not None and stats.queries > budget
+
+    metrics.add(endpoint, stats, over_budget)
+
+    db_ms = round(stats.seconds * 1000, 3)
+    response.headers['X-DB-Queries'] = str(stats.queries)
+    response.headers['Server-Timing'] = f'db;dur={db_ms};desc="{stats.queries} queries"'
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(dict(
+            endpoint=endpoint,
+            method=request.method,
+            status=response.status_code,
+            queries=stats.queries,
+            db_ms=db_ms,
+            slowest_ms=round(stats.slowest * 1000, 3),
+            slowest_statement=stats.slowest_statement,
+        )))
+
+    if over_budget:
+        message = f"{endpoint} ran {stats.queries} queries (budget {budget})"
+        if current_app.config['QUERY_BUDGET_STRICT']:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+    return response
+
+
+def show_metrics():
+    """Per-endpoint SQL totals since the process started."""
+
+    return jsonify(metrics.snapshot())
+
+
+def init_app(app):
+    """Instrument `app`'s requests and add the /metrics endpoint.
+
+    Call this before registering other request hooks: its after_request
+    hook then runs last, so the counts cover everything the others run.
+    """
+
+    app.config.setdefault('QUERY_BUDGET_STRICT', False)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', show_metrics)
@@ -0,0 +1,256 @@
+"""Background jobs.
+
+Request handlers hand slow side effects (fanning a message out to every
+follower's timeline, deleting an account and everything under it) to a
+queue instead of doing them before they respond:
+
+    jobs.enqueue('timeline.push', key=f'timeline.push:{msg.id}', message_id=msg.id)
+
+A job is a row in the `jobs` table added in the request's own transaction,
+so it exists exactly when the request's other changes do. Handlers are
+registered with `@handler(name)` and get the job's keyword arguments.
+They work through db.session and don't commit: the worker marks the job
+done in the same transaction, so a job's effects and its completion
+commit together.
+
+A job that raises is retried with exponential backoff, up to its
+max_attempts, and is then left as 'failed' with the error. A job whose
+worker died mid-run becomes claimable again once JOB_LEASE_SECONDS pass,
+so handlers must cope with running twice. Enqueueing with the `key` of a
+job that hasn't finished yet does nothing.
+
+Each web process runs JOB_WORKERS worker threads, started on the first
+request that enqueues. `flask worker` runs jobs in a separate process;
+pair it with JOB_WORKERS = 0 to keep jobs out of the web processes. With
+JOBS_INLINE set (as in tests), a request's jobs run right after its view
+returns, before the response is sent.
+"""
+
+import json
+import logging
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app, g, has_request_context
+from sqlalchemy.dialects import postgresql
+
+from models import db, Job, Message, Timeline, User
+
+logger = logging.getLogger('warbler.jobs')
+
+HANDLERS = {}
+
+
+def handler(name):
+    """Register the decorated function to run jobs called `name`."""
+
+    def register(fn):
+        HANDLERS[name] = fn
+        return fn
+
+    return register
+
+
+def enqueue(name, key=None, max_attempts=5, **payload):
+    """Queue job `name` with keyword arguments `payload`.
+
+    Added to the current transaction; it runs once that commits. Returns
+    whether a job was added (False if one with `key` is still pending).
+    """
+
+    table = Job.__table__
+    values = dict(name=name, payload=json.dumps(payload), idempotency_key=key,
+                  status='queued', attempts=0, max_attempts=max_attempts,
+                  run_at=datetime.utcnow(), created_at=datetime.utcnow())
+    dialect = db.session.get_bind().dialect.name
+
+    if key is None:
+        stmt = table.insert().values(**values)
+    elif dialect == 'postgresql':
+        stmt = (postgresql.insert(table)
+                .values(**values)
+                .on_conflict_do_nothing(index_elements=['idempotency_key']))
+    elif dialect == 'sqlite':
+        stmt = table.insert().values(**values).prefix_with('OR IGNORE')
+    else:
+        already = db.select([table.c.id]).where(table.c.idempotency_key == key)
+        stmt = table.insert().from_select(
+            list(values), db.select([db.literal(v) for v in values.values()])
+            .where(~already.exists()))
+
+    added = db.session.execute(stmt).rowcount == 1
+    if added and has_request_context():
+        g.jobs_enqueued = True
+    return added
+
+
+def _due(now, lease):
+    return db.or_(
+        db.and_(Job.status == 'queued', Job.run_at <= now),
+        # a worker took it and never finished
+        db.and_(Job.status == 'running', Job.locked_at < now - timedelta(seconds=lease)))
+
+
+def claim(lease):
+    """Mark the oldest due job as running and return its id, or None."""
+
+    while True:
+        now = datetime.utcnow()
+        due = _due(now, lease)
+
+        candidate = (db.session
+                     .query(Job.id)
+                     .filter(due)
+                     .order_by(Job.run_at, Job.id)
+                     .limit(1))
+        if db.session.get_bind().dialect.name == 'postgresql':
+            candidate = candidate.with_for_update(skip_locked=True)
+        job_id = candidate.scalar()
+        if job_id is None:
+            db.session.commit()
+            return None
+
+        # another worker may have claimed it since; then look again
+        claimed = (db.session
+                   .query(Job)
+                   .filter(Job.id == job_id, due)
+                   .update({Job.status: 'running', Job.locked_at: now,
+                            Job.attempts: Job.attempts + 1},
+                           synchronize_session=False))
+        db.session.commit()
+        if claimed:
+            return job_id
+
+
+def run(job_id):
+    """Run claimed job `job_id`, recording whether it worked."""
+
+    job = Job.query.get(job_id)
+    try:
+        fn = HANDLERS.get(job.name)
+        if fn is None:
+            raise LookupError(f"No handler for job {job.name!r}")
+        fn(**json.loads(job.payload))
+
+        job.status = 'done'
+        job.finished_at = datetime.utcnow()
+        job.last_error = None
+        job.idempotency_key = None
+        db.session.commit()
+        return True
+
+    except Exception:
+        db.session.rollback()
+        logger.exception("Job %s (%s) failed", job_id, job.name)
+
+        job = Job.query.get(job_id)
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+            job.idempotency_key = None
+        else:
+            job.status = 'queued'
+            job.run_at = datetime.utcnow() + timedelta(
+                seconds=current_app.config['JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1))
+        db.session.commit()
+        return False
+
+
+def work(app):
+    """Run due jobs until there are none left; return how many ran."""
+
+    ran = 0
+    with app.app_context():
+        lease = app.config['JOB_LEASE_SECONDS']
+        while True:
+            job_id = claim(lease)
+            if job_id is None:
+                return ran
+            run(job_id)
+            ran += 1
+
+
+class WorkerPool:
+    """Daemon threads that run jobs as they come due."""
+
+    def __init__(self, app, threads, poll_seconds=1.0):
+        self.app = app
+        self.threads = threads
+        self.poll_seconds = poll_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._started = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            while len(self._started) < self.threads:
+                thread = threading.Thread(target=self._loop, daemon=True,
+                                          name=f'warbler-jobs-{len(self._started)}')
+                thread.start()
+                self._started.append(thread)
+
+    def wake(self):
+        """Look for work now rather than at the next poll."""
+
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._started:
+            thread.join()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                ran = work(self.app)
+            except Exception:
+                logger.exception("Job worker error")
+                ran = 0
+            if not ran:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+
+def _after_request(response):
+    if g.get('jobs_enqueued'):
+        app = current_app._get_current_object()
+        if app.config['JOBS_INLINE']:
+            work(app)
+        elif app.config['JOB_WORKERS']:
+            pool = app.extensions['jobs']
+            pool.start()
+            pool.wake()
+    return response
+
+
+@handler('timeline.push')
+def push_to_timelines(message_id):
+    """Fan a new message out to its author's and followers' timelines."""
+
+    msg = Message.query.get(message_id)
+    if msg is not None:
+        Timeline.push(msg)
+
+
+@handler('users.delete')
+def delete_user(user_id):
+    """Delete a user; the database cascades to their messages, follows and likes."""
+
+    user = User.query.get(user_id)
+    if user is not None:
+        db.session.delete(user)
+
+
+def init_app(app):
+    """Run jobs enqueued by `app`'s requests."""
+
+    app.config.setdefault('JOB_WORKERS', 2)
+    app.config.setdefault('JOBS_INLINE', False)
+    app.config.setdefault('JOB_LEASE_SECONDS', 300)
+    app.config.setdefault('JOB_RETRY_DELAY', 5)
+    app.extensions['jobs'] = WorkerPool(app, app.config['JOB_WORKERS'])
+    app.after_request(_after_request)
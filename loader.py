@@ -0,0 +1,123 @@
+"""Streaming, restartable CSV loader for seeding Warbler databases.
+
+Rows are read from the CSV a batch at a time and each batch is committed
+on its own, so memory stays bounded however big the file is. On Postgres
+each batch is sent with `COPY ... FROM STDIN`; elsewhere it's a batched
+executemany INSERT.
+
+Progress is committed in the same transaction as each batch, in the
+`load_progress` table, so a load that dies part way through picks up
+after the last committed batch when it's run again.
+"""
+
+import csv
+import io
+import time
+from collections import namedtuple
+from datetime import datetime
+from itertools import islice
+
+from models import db
+
+LoadStats = namedtuple('LoadStats', ['table', 'rows', 'seconds', 'resumed_from'])
+
+load_progress = db.Table(
+    'load_progress',
+    db.Column('table_name', db.Text, primary_key=True),
+    db.Column('source', db.Text, primary_key=True),
+    db.Column('rows_loaded', db.Integer, nullable=False),
+)
+
+
+def _converter(column):
+    """Turn a CSV string into the value `column` expects (for executemany)."""
+
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        python_type = str
+
+    if python_type is datetime:
+        parse = datetime.fromisoformat
+    elif python_type in (int, float):
+        parse = python_type
+    else:
+        parse = str
+
+    return lambda value: parse(value) if value != '' else None
+
+
+def _copy_batch(connection, table, columns, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer)
+
+
+def _insert_batch(connection, table, columns, rows):
+    converters = [_converter(table.c[name]) for name in columns]
+    connection.execute(table.insert(), [
+        {name: convert(value) for name, convert, value in zip(columns, converters, row)}
+        for row in rows
+    ])
+
+
+def load_csv(engine, table, path, batch_size=10000, progress=None):
+    """Stream the CSV at `path` into `table`, `batch_size` rows per commit.
+
+    The CSV's header names the columns. If an earlier load of the same
+    file into the same table was interrupted, rows it committed are
+    skipped. `progress`, if given, is called with the running row count
+    after each batch. Returns a LoadStats.
+    """
+
+    load_progress.create(engine, checkfirst=True)
+    key = dict(table_name=table.name, source=str(path))
+    use_copy = engine.dialect.name == 'postgresql'
+    start = time.perf_counter()
+
+    with engine.connect() as connection:
+        done = connection.execute(
+            db.select([load_progress.c.rows_loaded])
+            .where(load_progress.c.table_name == table.name)
+            .where(load_progress.c.source == str(path))).scalar()
+
+    if done is None:
+        done = 0
+        with engine.begin() as connection:
+            connection.execute(load_progress.insert().values(rows_loaded=0, **key))
+    resumed_from = done
+
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader)
+        rows = islice(reader, done, None)
+
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+
+            with engine.begin() as connection:
+                if use_copy:
+                    _copy_batch(connection, table, columns, batch)
+                else:
+                    _insert_batch(connection, table, columns, batch)
+
+                done += len(batch)
+                connection.execute(
+                    load_progress.update()
+                    .where(load_progress.c.table_name == table.name)
+                    .where(load_progress.c.source == str(path))
+                    .values(rows_loaded=done))
+
+            if progress:
+                progress(done)
+
+    return LoadStats(table.name, done - resumed_from,
+                     time.perf_counter() - start, resumed_from)
+
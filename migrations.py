@@ -0,0 +1,263 @@
+"""Versioned schema migrations for Warbler.
+
+`db.create_all()` only creates missing tables; it never adds indexes or
+columns to a database that already exists. Each migration here is a
+numbered, idempotent upgrade step, and the versions that have been applied
+are recorded in the `schema_migrations` table.
+
+Run pending migrations with:
+
+    FLASK_APP=app flask migrate
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+
+from models import db, Follows, Job, Likes, Message, Timeline, User, USER_SEARCH_DDL
+import partitions
+
+Migration = namedtuple('Migration', ['version', 'description', 'upgrade'])
+
+MIGRATIONS = []
+
+schema_migrations = db.Table(
+    'schema_migrations',
+    db.Column('version', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('description', db.Text, nullable=False),
+    db.Column('applied_at', db.DateTime, nullable=False),
+)
+
+
+def migration(version, description):
+    """Register the decorated `upgrade(connection)` function as a migration."""
+
+    def register(upgrade):
+        MIGRATIONS.append(Migration(version, description, upgrade))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return upgrade
+
+    return register
+
+
+def create_index(connection, index):
+    """Create `index` unless its table already has an index by that name."""
+
+    existing = {i['name'] for i in inspect(connection).get_indexes(index.table.name)}
+    if index.name not in existing:
+        index.create(connection)
+
+
+def add_column(connection, column):
+    """Add `column` to its table unless the table already has it."""
+
+    table = column.table.name
+    existing = {c['name'] for c in inspect(connection).get_columns(table)}
+    if column.name not in existing:
+        ddl = CreateColumn(column).compile(dialect=connection.dialect)
+        connection.execute(f"ALTER TABLE {table} ADD COLUMN {ddl}")
+
+
+def rebuild_sqlite_table(connection, table):
+    """Recreate `table` from its model, keeping its rows.
+
+    For changes SQLite's ALTER TABLE can't make, such as dropping a
+    constraint or adding a column with a non-constant default. Columns the
+    old table lacks get their defaults. Other tables' foreign keys keep
+    pointing at the table.
+    """
+
+    inspector = inspect(connection)
+    old_columns = {c['name'] for c in inspector.get_columns(table.name)}
+    for index in inspector.get_indexes(table.name):
+        connection.execute(f"DROP INDEX IF EXISTS {index['name']}")
+
+    # otherwise SQLite repoints those foreign keys at the renamed table
+    connection.execute("PRAGMA legacy_alter_table = ON")
+    connection.execute(f"ALTER TABLE {table.name} RENAME TO {table.name}_old")
+    connection.execute("PRAGMA legacy_alter_table = OFF")
+    table.create(connection)
+    columns = ', '.join(c.name for c in table.columns if c.name in old_columns)
+    connection.execute(f"INSERT INTO {table.name} ({columns}) "
+                       f"SELECT {columns} FROM {table.name}_old")
+    connection.execute(f"DROP TABLE {table.name}_old")
+
+
+def index_named(table, name):
+    """Find the index called `name` declared on `table`."""
+
+    return next(i for i in table.indexes if i.name == name)
+
+
+##############################################################################
+# Migrations (append only; never edit one that has shipped)
+
+
+@migration(1, "Add materialized home timelines")
+def add_timelines(connection):
+    Timeline.__table__.create(connection, checkfirst=True)
+    Timeline.rebuild(connection)
+
+
+@migration(2, "Add composite indexes for feed, follow and like lookups")
+def add_hot_path_indexes(connection):
+    create_index(connection, index_named(Message.__table__, 'ix_messages_user_id_timestamp'))
+    create_index(connection, index_named(Follows.__table__, 'ix_follows_user_following_id'))
+    create_index(connection, index_named(Likes.__table__, 'ix_likes_user_id_message_id'))
+
+
+@migration(3, "Add trigram index for username search")
+def add_username_trigram_index(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        connection.execute("CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+                           "ON users USING gin (username gin_trgm_ops)")
+
+
+@migration(4, "Add denormalized message/follower/following/like counters")
+def add_user_counters(connection):
+    for name in ['message_count', 'follower_count', 'following_count', 'like_count']:
+        add_column(connection, User.__table__.c[name])
+
+    # Not User.repair_counters(): the model may have columns (and onupdate
+    # hooks) that later migrations add.
+    connection.execute("""
+        UPDATE users SET
+            message_count = (SELECT count(*) FROM messages
+                             WHERE messages.user_id = users.id),
+            follower_count = (SELECT count(*) FROM follows
+                              WHERE follows.user_being_followed_id = users.id),
+            following_count = (SELECT count(*) FROM follows
+                               WHERE follows.user_following_id = users.id),
+            like_count = (SELECT count(*) FROM likes
+                          WHERE likes.user_id = users.id)
+    """)
+
+
+@migration(5, "Add user search indexes (pg_trgm on Postgres, FTS5 on SQLite)")
+def add_user_search_indexes(connection):
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        # superseded by the index over username, bio and location
+        connection.execute("DROP INDEX IF EXISTS ix_users_username_trgm")
+
+    for statement in USER_SEARCH_DDL.get(dialect, []):
+        connection.execute(statement)
+
+    if dialect == 'sqlite':
+        connection.execute("INSERT INTO users_fts(users_fts) VALUES ('rebuild')")
+
+
+@migration(6, "Let many users like a message; one like per user and message")
+def make_likes_unique_per_user(connection):
+    inspector = inspect(connection)
+    message_id_unique = any(c['column_names'] == ['message_id']
+                            for c in inspector.get_unique_constraints('likes'))
+    old_index = next((i for i in inspector.get_indexes('likes')
+                      if i['name'] == 'ix_likes_user_id_message_id'), None)
+
+    if message_id_unique and connection.dialect.name == 'sqlite':
+        # SQLite can't drop a constraint, so copy into a fresh table
+        connection.execute("DROP INDEX IF EXISTS ix_likes_user_id_message_id")
+        connection.execute("ALTER TABLE likes RENAME TO likes_old")
+        Likes.__table__.create(connection)
+        connection.execute("INSERT INTO likes (id, user_id, message_id) "
+                           "SELECT id, user_id, message_id FROM likes_old")
+        connection.execute("DROP TABLE likes_old")
+        return
+
+    for c in inspector.get_unique_constraints('likes'):
+        if c['column_names'] == ['message_id']:
+            connection.execute(f"ALTER TABLE likes DROP CONSTRAINT {c['name']}")
+
+    if old_index is not None and not old_index['unique']:
+        connection.execute("DROP INDEX ix_likes_user_id_message_id")
+
+    create_index(connection, index_named(Likes.__table__, 'ix_likes_user_id_message_id'))
+    create_index(connection, index_named(Likes.__table__, 'ix_likes_message_id'))
+
+
+@migration(7, "Record when follows and likes were made, for paging those lists")
+def add_follow_and_like_timestamps(connection):
+    for table in [Follows.__table__, Likes.__table__]:
+        existing = {c['name'] for c in inspect(connection).get_columns(table.name)}
+        if 'timestamp' in existing:
+            continue
+
+        if connection.dialect.name == 'sqlite':
+            # existing rows are stamped with the time of the upgrade
+            rebuild_sqlite_table(connection, table)
+        else:
+            add_column(connection, table.c.timestamp)
+
+    create_index(connection, index_named(Follows.__table__, 'ix_follows_followed_timestamp'))
+    create_index(connection, index_named(Follows.__table__, 'ix_follows_following_timestamp'))
+    create_index(connection, index_named(Likes.__table__, 'ix_likes_user_id_timestamp'))
+
+
+@migration(8, "Add users.updated_at for HTTP cache validators")
+def add_user_updated_at(connection):
+    add_column(connection, User.__table__.c.updated_at)
+    users = User.__table__
+    connection.execute(users.update()
+                       .where(users.c.updated_at.is_(None))
+                       .values(updated_at=datetime.utcnow()))
+
+
+@migration(9, "Add the background job queue")
+def add_jobs(connection):
+    Job.__table__.create(connection, checkfirst=True)
+
+
+@migration(10, "Stamp messages in the database; partition messages by month on Postgres")
+def partition_messages(connection):
+    if connection.dialect.name == 'sqlite':
+        timestamp = next(c for c in inspect(connection).get_columns('messages')
+                         if c['name'] == 'timestamp')
+        if timestamp['default'] is None:
+            rebuild_sqlite_table(connection, Message.__table__)
+    else:
+        # creates the new table with the default
+        partitions.partition_messages(connection)
+
+
+##############################################################################
+# Runner
+
+
+def applied_versions(connection):
+    """Set of migration versions already applied to this database."""
+
+    schema_migrations.create(connection, checkfirst=True)
+    return {row.version for row in connection.execute(schema_migrations.select())}
+
+
+def pending_migrations(connection):
+    """Migrations not yet applied, in the order they should run."""
+
+    applied = applied_versions(connection)
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def upgrade(engine):
+    """Apply every pending migration, each in its own transaction.
+
+    Returns the migrations that were applied.
+    """
+
+    with engine.begin() as connection:
+        pending = pending_migrations(connection)
+
+    for m in pending:
+        with engine.begin() as connection:
+            m.upgrade(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=m.version,
+                description=m.description,
+                applied_at=datetime.utcnow(),
+            ))
+
+    return pending
@@ -2,11 +2,39 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm.attributes import PASSIVE_NO_INITIALIZE, get_history
+from sqlalchemy.sql.expression import FunctionElement
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from hashing import HashingBusy, hasher
+from replicas import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
+
+
+class utcnow(FunctionElement):
+    """The database's current UTC time, as a naive timestamp."""
+
+    type = db.DateTime()
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    # the time of this statement, not of the transaction's start
+    return "TIMEZONE('utc', STATEMENT_TIMESTAMP())"
+
+
+@compiles(utcnow, 'sqlite')
+def _utcnow_sqlite(element, compiler, **kw):
+    # the format SQLAlchemy stores datetimes in, so they compare as equal
+    return "STRFTIME('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
 
 
 class Follows(db.Model):
@@ -26,6 +54,26 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # when the follow started; followers/following pages are newest first
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    # The primary key leads with the followed user (followers lookups);
+    # this covers the reverse direction (following lookups). The timestamp
+    # indexes serve the followers/following pages a page at a time.
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id',
+                 'user_following_id', 'user_being_followed_id'),
+        db.Index('ix_follows_followed_timestamp',
+                 'user_being_followed_id', 'timestamp', 'user_following_id'),
+        db.Index('ix_follows_following_timestamp',
+                 'user_following_id', 'timestamp', 'user_being_followed_id'),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
@@ -45,9 +93,91 @@ class Likes(db.Model):
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
     )
 
+    # when the like was made; the likes page is newest first
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    # A user likes a message at most once; the unique index is also the
+    # conflict target for idempotent likes (see `like`).
+    __table_args__ = (
+        db.Index('ix_likes_user_id_message_id', 'user_id', 'message_id', unique=True),
+        db.Index('ix_likes_message_id', 'message_id'),
+        db.Index('ix_likes_user_id_timestamp', 'user_id', 'timestamp', 'id'),
+    )
+
+    @classmethod
+    def like(cls, user_id, message_id):
+        """Record that `user_id` likes `message_id`; a no-op if they already do.
+
+        One INSERT that ignores a conflicting row, rather than loading the
+        user's likes to check first. Returns whether a row was added.
+        """
+
+        table = cls.__table__
+        values = dict(user_id=user_id, message_id=message_id)
+        dialect = db.session.get_bind().dialect.name
+
+        if dialect == 'postgresql':
+            stmt = (postgresql.insert(table)
+                    .values(**values)
+                    .on_conflict_do_nothing(index_elements=['user_id', 'message_id']))
+        elif dialect == 'sqlite':
+            stmt = table.insert().values(**values).prefix_with('OR IGNORE')
+        else:
+            already = (db.select([table.c.id])
+                       .where(table.c.user_id == user_id)
+                       .where(table.c.message_id == message_id))
+            stmt = table.insert().from_select(
+                ['user_id', 'message_id'],
+                db.select([db.literal(user_id), db.literal(message_id)])
+                .where(~already.exists()))
+
+        added = db.session.execute(stmt).rowcount == 1
+        if added:
+            _apply(db.session, {user_id: {'like_count': 1}})
+        return added
+
+    @classmethod
+    def unlike(cls, user_id, message_id):
+        """Remove `user_id`'s like of `message_id`, if any; returns whether one was."""
+
+        table = cls.__table__
+        removed = db.session.execute(
+            table.delete()
+            .where(table.c.user_id == user_id)
+            .where(table.c.message_id == message_id)).rowcount == 1
+        if removed:
+            _apply(db.session, {user_id: {'like_count': -1}})
+        return removed
+
+    @classmethod
+    def toggle(cls, user_id, message_id):
+        """Like `message_id` if `user_id` doesn't already, otherwise unlike it.
+
+        Tries the targeted DELETE first and only inserts when nothing was
+        deleted. Returns whether the message is now liked.
+        """
+
+        if cls.unlike(user_id, message_id):
+            return False
+        cls.like(user_id, message_id)
+        return True
+
+    @classmethod
+    def count_for(cls, message_id):
+        """How many users like `message_id`."""
+
+        return (db.session
+                .query(db.func.count(cls.id))
+                .filter(cls.message_id == message_id)
+                .scalar())
+
 
 class User(db.Model):
     """User in the system."""
@@ -94,7 +224,50 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message')
+    # Denormalized relationship sizes for the stats cards. These are kept
+    # in step by the flush hooks at the bottom of this module; run
+    # `flask repair-counters` after loading data behind the ORM's back.
+    message_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    follower_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Bumped by every UPDATE of the row, including the counter UPDATEs
+    # below, so it changes whenever anything a page shows about this user
+    # (or their follows and likes, as the viewer) does. Pages use it as
+    # their ETag/Last-Modified (see http_cache.py).
+    updated_at = db.Column(
+        db.DateTime,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+    )
+
+    # messages are removed by the database's ON DELETE CASCADE; don't
+    # have the ORM try to null out their user_id first
+    messages = db.relationship('Message', passive_deletes='all')
 
     followers = db.relationship(
         "User",
@@ -119,18 +292,74 @@ class User(db.Model):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
     def is_followed_by(self, other_user):
-        """Is this user followed by `other_user`?"""
+        """Is this user followed by `other_user`?
+
+        A single primary-key lookup in `follows`; the followers collection
+        isn't loaded.
+        """
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.is_following(self)
 
     def is_following(self, other_user):
-        """Is this user following `other_use`?"""
+        """Is this user following `other_user`?
+
+        A single primary-key lookup in `follows`; the following collection
+        isn't loaded.
+        """
+
+        row = Follows.query.filter_by(user_being_followed_id=other_user.id,
+                                      user_following_id=self.id)
+        return db.session.query(row.exists()).scalar()
+
+    def following_ids(self, user_ids):
+        """Which of `user_ids` this user follows, as a set.
+
+        Answers the follow state of a whole page of users in one query.
+        """
+
+        if not user_ids:
+            return set()
+
+        rows = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == self.id,
+                        Follows.user_being_followed_id.in_(user_ids)))
+        return {user_id for (user_id,) in rows}
+
+    def liked_ids(self, message_ids):
+        """Which of `message_ids` this user likes, as a set.
+
+        Answers the like buttons for a whole page of messages in one query.
+        """
+
+        if not message_ids:
+            return set()
+
+        rows = (db.session
+                .query(Likes.message_id)
+                .filter(Likes.user_id == self.id,
+                        Likes.message_id.in_(message_ids)))
+        return {message_id for (message_id,) in rows}
+
+    @classmethod
+    def repair_counters(cls, bind=None):
+        """Recompute every user's counter columns from the source tables.
+
+        Runs on `bind` (a connection) if given, otherwise on the session.
+        """
+
+        users = cls.__table__
+
+        def count(column):
+            return db.select([db.func.count()]).where(column == users.c.id).as_scalar()
+
+        (bind or db.session).execute(users.update().values(
+            message_count=count(Message.user_id),
+            follower_count=count(Follows.user_being_followed_id),
+            following_count=count(Follows.user_following_id),
+            like_count=count(Likes.user_id),
+        ))
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
-        
-        
     @classmethod
     def signup(cls, username, email, password, image_url):
         """Sign up user.
@@ -138,7 +367,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.generate_password_hash(password)
 
         user = User(
             username=username,
@@ -159,13 +388,21 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made at a different work factor than the one
+        configured now, it's transparently re-hashed (the caller commits).
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check_password_hash(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    try:
+                        user.password = hasher.generate_password_hash(password)
+                    except HashingBusy:
+                        pass  # keep the old hash; try again next login
                 return user
 
         return False
@@ -186,10 +423,13 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Stamped by the database as each row is inserted, so messages from
+    # every web process share one clock. Messages are partitioned by this
+    # column on Postgres (see partitions.py).
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        server_default=utcnow(),
     )
 
     user_id = db.Column(
@@ -200,11 +440,451 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    # Drives both profile pages and keyset pagination of a user's messages.
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp', 'id'),
+    )
+
+    # read the timestamp back with the INSERT (RETURNING on Postgres)
+    __mapper_args__ = {'eager_defaults': True}
+
+
+class Timeline(db.Model):
+    """A message pushed onto a user's home timeline.
+
+    Timelines are materialized on write: posting a message fans it out to
+    the author's followers, so the home page reads one bounded, ordered
+    list instead of sorting every followed user's messages per request.
+    """
+
+    __tablename__ = 'timelines'
+
+    # Entries beyond this many per user are trimmed on backfill.
+    MAX_LENGTH = 800
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timelines_user_id_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+    )
+
+    @classmethod
+    def push(cls, message):
+        """Fan `message` out to its author's timeline and their followers'.
+
+        The message must already be flushed so that it has an id.
+        """
+
+        followers = (db.session
+                     .query(Follows.user_following_id,
+                            db.literal(message.id),
+                            db.literal(message.user_id),
+                            db.literal(message.timestamp))
+                     .filter(Follows.user_being_followed_id == message.user_id))
+
+        db.session.add(cls(user_id=message.user_id,
+                           message_id=message.id,
+                           author_id=message.user_id,
+                           timestamp=message.timestamp))
+        db.session.flush()
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                ['user_id', 'message_id', 'author_id', 'timestamp'],
+                followers))
+
+    @classmethod
+    def backfill(cls, user_id, followed_id):
+        """Copy `followed_id`'s recent messages onto `user_id`'s timeline."""
+
+        recent = (db.session
+                  .query(db.literal(user_id),
+                         Message.id,
+                         Message.user_id,
+                         Message.timestamp)
+                  .filter(Message.user_id == followed_id)
+                  .order_by(Message.timestamp.desc())
+                  .limit(cls.MAX_LENGTH))
+
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                ['user_id', 'message_id', 'author_id', 'timestamp'],
+                recent))
+        cls.trim(user_id)
+
+    @classmethod
+    def prune(cls, user_id, followed_id):
+        """Remove `followed_id`'s messages from `user_id`'s timeline."""
+
+        (cls.query
+         .filter(cls.user_id == user_id, cls.author_id == followed_id)
+         .delete(synchronize_session=False))
+
+    @classmethod
+    def remove(cls, message_id):
+        """Remove a message from every timeline it was pushed to."""
+
+        (cls.query
+         .filter(cls.message_id == message_id)
+         .delete(synchronize_session=False))
+
+    @classmethod
+    def trim(cls, user_id):
+        """Drop entries beyond MAX_LENGTH from `user_id`'s timeline."""
+
+        cutoff = (db.session
+                  .query(cls.timestamp)
+                  .filter(cls.user_id == user_id)
+                  .order_by(cls.timestamp.desc())
+                  .offset(cls.MAX_LENGTH)
+                  .limit(1)
+                  .scalar())
+
+        if cutoff is not None:
+            (cls.query
+             .filter(cls.user_id == user_id, cls.timestamp <= cutoff)
+             .delete(synchronize_session=False))
+
+    @classmethod
+    def rebuild(cls, bind=None):
+        """Rebuild every timeline from the follows and messages tables.
+
+        Used after bulk loads (see seed.py), which bypass fan-out. Runs on
+        `bind` (a connection) if given, otherwise on the session.
+        """
+
+        bind = bind or db.session
+
+        own = db.session.query(Message.user_id.label('user_id'),
+                               Message.id.label('message_id'),
+                               Message.user_id.label('author_id'),
+                               Message.timestamp.label('timestamp'))
+        followed = (db.session
+                    .query(Follows.user_following_id,
+                           Message.id,
+                           Message.user_id,
+                           Message.timestamp)
+                    .join(Message,
+                          Message.user_id == Follows.user_being_followed_id))
+
+        entries = own.union_all(followed).subquery()
+        position = (db.func.row_number()
+                    .over(partition_by=entries.c.user_id,
+                          order_by=entries.c.timestamp.desc()))
+        ranked = db.session.query(entries, position.label('position')).subquery()
+
+        # keep only the newest MAX_LENGTH per user, as trim() would
+        newest = (db.session
+                  .query(ranked.c.user_id, ranked.c.message_id,
+                         ranked.c.author_id, ranked.c.timestamp)
+                  .filter(ranked.c.position <= cls.MAX_LENGTH))
+
+        bind.execute(cls.__table__.delete())
+        bind.execute(
+            cls.__table__.insert().from_select(
+                ['user_id', 'message_id', 'author_id', 'timestamp'],
+                newest))
+
+    @classmethod
+    def query_for(cls, user_id):
+        """Unordered query of the messages on `user_id`'s timeline.
+
+        Order (or paginate) on Timeline.timestamp and Timeline.message_id
+        so the read stays on the timeline index. Joining on the timestamp
+        too lets Postgres look each message up in its month's partition
+        alone.
+        """
+
+        return (Message
+                .query
+                .join(cls, db.and_(cls.message_id == Message.id,
+                                   cls.timestamp == Message.timestamp))
+                .filter(cls.user_id == user_id))
+
+    @classmethod
+    def messages_for(cls, user_id, limit=100):
+        """Most recent messages on `user_id`'s timeline, newest first."""
+
+        return (cls.query_for(user_id)
+                .order_by(cls.timestamp.desc(), cls.message_id.desc())
+                .limit(limit)
+                .all())
+
+
+class Job(db.Model):
+    """A queued piece of background work; see jobs.py."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    name = db.Column(
+        db.String(100),
+        nullable=False,
+    )
+
+    # JSON arguments for the job's handler
+    payload = db.Column(
+        db.Text,
+        nullable=False,
+        default='{}',
+    )
+
+    # enqueueing again with the same key is a no-op until this job finishes
+    idempotency_key = db.Column(
+        db.String(200),
+        unique=True,
+    )
+
+    # queued -> running -> done, or back to queued to retry, or failed
+    status = db.Column(
+        db.String(20),
+        nullable=False,
+        default='queued',
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    max_attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=5,
+    )
+
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    locked_at = db.Column(
+        db.DateTime,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    __table_args__ = (
+        # workers look for the oldest due job in a status
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+
+##############################################################################
+# Counter maintenance
+#
+# User's *_count columns are adjusted with `col = col + n` UPDATEs in the
+# same transaction as the flush that changes the underlying rows, whether
+# they were added as Message/Follows/Likes objects or through the
+# following/followers/likes collections.
+
+
+def _bump(deltas, user_id, column, n):
+    if user_id is not None:
+        deltas.setdefault(user_id, {}).setdefault(column, 0)
+        deltas[user_id][column] += n
+
+
+def _apply(session, deltas):
+    users = User.__table__
+    for user_id, changes in deltas.items():
+        values = {column: users.c[column] + n for column, n in changes.items() if n}
+        if values:
+            session.execute(users.update().where(users.c.id == user_id).values(**values))
+
+    session.info.setdefault('counted_user_ids', set()).update(deltas)
+
+
+@event.listens_for(db.session, 'before_flush')
+def _count_cascaded_deletes(session, flush_context, instances):
+    """Adjust counters for rows the database is about to cascade-delete."""
+
+    users = User.__table__
+    deltas = {}
+
+    for obj in session.deleted:
+        if isinstance(obj, Message):
+            _bump(deltas, obj.user_id, 'message_count', -1)
+            likers = db.select([Likes.user_id]).where(Likes.message_id == obj.id)
+            session.execute(users.update()
+                            .where(users.c.id.in_(likers))
+                            .values(like_count=users.c.like_count - 1))
+
+        elif isinstance(obj, User):
+            followed = (db.select([Follows.user_being_followed_id])
+                        .where(Follows.user_following_id == obj.id))
+            followers = (db.select([Follows.user_following_id])
+                         .where(Follows.user_being_followed_id == obj.id))
+            likes_of_their_messages = (
+                db.select([db.func.count()])
+                .select_from(Likes.__table__.join(Message.__table__))
+                .where(Message.user_id == obj.id)
+                .where(Likes.user_id == users.c.id)
+                .as_scalar())
+
+            session.execute(users.update()
+                            .where(users.c.id.in_(followed))
+                            .values(follower_count=users.c.follower_count - 1))
+            session.execute(users.update()
+                            .where(users.c.id.in_(followers))
+                            .values(following_count=users.c.following_count - 1))
+            session.execute(users.update()
+                            .where(users.c.id != obj.id)
+                            .where(likes_of_their_messages > 0)
+                            .values(like_count=users.c.like_count - likes_of_their_messages))
+
+    _apply(session, deltas)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _count_flushed_rows(session, flush_context):
+    """Adjust counters for rows inserted or deleted by this flush."""
+
+    deltas = {}
+
+    for obj, n in [(o, 1) for o in session.new] + [(o, -1) for o in session.deleted]:
+        if isinstance(obj, Message) and n == 1:
+            _bump(deltas, obj.user_id, 'message_count', n)
+        elif isinstance(obj, Follows):
+            _bump(deltas, obj.user_following_id, 'following_count', n)
+            _bump(deltas, obj.user_being_followed_id, 'follower_count', n)
+        elif isinstance(obj, Likes):
+            _bump(deltas, obj.user_id, 'like_count', n)
+
+    for user in set(session.new) | set(session.dirty):
+        if not isinstance(user, User):
+            continue
+
+        for attr, own_column, other_column in [
+                ('following', 'following_count', 'follower_count'),
+                ('followers', 'follower_count', 'following_count'),
+                ('likes', 'like_count', None)]:
+            history = get_history(user, attr, passive=PASSIVE_NO_INITIALIZE)
+            for other, n in ([(o, 1) for o in history.added or ()] +
+                             [(o, -1) for o in history.deleted or ()]):
+                _bump(deltas, user.id, own_column, n)
+                if other_column:
+                    _bump(deltas, other.id, other_column, n)
+
+    _apply(session, deltas)
+
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def _expire_counters(session, flush_context):
+    """Make loaded users re-read counters changed behind the ORM's back."""
+
+    counters = ['message_count', 'follower_count', 'following_count', 'like_count',
+                'updated_at']
+    for user_id in session.info.pop('counted_user_ids', ()):
+        user = session.identity_map.get(inspect(User).identity_key_from_primary_key((user_id,)))
+        if user is not None and user not in session.deleted:
+            session.expire(user, counters)
+
+
+##############################################################################
+# User search indexes
+#
+# `/users?q=` matches anywhere in a user's username, bio or location (see
+# search.py), which no B-tree index can serve. On Postgres a pg_trgm GIN
+# index over that text does; on SQLite an FTS5 table with the trigram
+# tokenizer, kept in step by triggers, stands in for it. Both are
+# dialect-specific, so they're created here rather than in `__table_args__`.
+
+SEARCH_DOCUMENT_SQL = (
+    "(username || ' ' || coalesce(bio, '') || ' ' || coalesce(location, ''))"
+)
+
+USER_SEARCH_DDL = {
+    'postgresql': [
+        "CREATE INDEX IF NOT EXISTS ix_users_search_trgm "
+        f"ON users USING gin ({SEARCH_DOCUMENT_SQL} gin_trgm_ops)",
+        # serves autocomplete's username range scans in any collation
+        "CREATE INDEX IF NOT EXISTS ix_users_username_prefix "
+        "ON users (username text_pattern_ops)",
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+        "username, bio, location, content='users', content_rowid='id', "
+        "tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN "
+        "INSERT INTO users_fts(rowid, username, bio, location) "
+        "VALUES (new.id, new.username, new.bio, new.location); END",
+        "CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN "
+        "INSERT INTO users_fts(users_fts, rowid, username, bio, location) "
+        "VALUES ('delete', old.id, old.username, old.bio, old.location); END",
+        # only the searched columns; counter updates shouldn't touch the index
+        "CREATE TRIGGER IF NOT EXISTS users_fts_update "
+        "AFTER UPDATE OF username, bio, location ON users BEGIN "
+        "INSERT INTO users_fts(users_fts, rowid, username, bio, location) "
+        "VALUES ('delete', old.id, old.username, old.bio, old.location); "
+        "INSERT INTO users_fts(rowid, username, bio, location) "
+        "VALUES (new.id, new.username, new.bio, new.location); END",
+    ],
+}
+
+event.listen(
+    User.__table__,
+    'before_create',
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect='postgresql'),
+)
+
+for dialect, statements in USER_SEARCH_DDL.items():
+    for statement in statements:
+        event.listen(User.__table__, 'after_create',
+                     DDL(statement).execute_if(dialect=dialect))
+
+event.listen(
+    User.__table__,
+    'after_drop',
+    DDL("DROP TABLE IF EXISTS users_fts").execute_if(dialect='sqlite'),
+)
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
 
-    You should call this in your Flask app.
+    You should call this in your Flask app. Each engine's pool is sized
+    and health-checked from the app's DB_* settings (see db_pool.py).
     """
 
     db.app = app
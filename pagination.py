@@ -0,0 +1,60 @@
+"""Keyset (cursor) pagination for Warbler's message and user lists.
+
+Pages are keyed on (timestamp, id) rather than OFFSET, so fetching page 50
+costs the same bounded index range scan as fetching page 1.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from models import db
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+CURSOR_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(timestamp, id):
+    """Build the `?before=` token for the row at (timestamp, id)."""
+
+    return f"{timestamp.strftime(CURSOR_TIMESTAMP_FORMAT)}_{id}"
+
+
+def decode_cursor(token):
+    """Parse a `?before=` token into (timestamp, id).
+
+    Raises ValueError if the token is malformed.
+    """
+
+    timestamp, _, id = token.rpartition('_')
+    return datetime.strptime(timestamp, CURSOR_TIMESTAMP_FORMAT), int(id)
+
+
+def paginate(query, timestamp_col, id_col, before=None, per_page=20):
+    """Return one page of `query`, newest first, starting after `before`.
+
+    `timestamp_col` and `id_col` are the columns the page is keyed on;
+    they should be covered by an index that leads with the query's
+    equality filter. They needn't belong to the entity being listed (a
+    page of users can be keyed on when each follow began). Raises
+    ValueError if `before` is malformed.
+    """
+
+    if before:
+        timestamp, id = decode_cursor(before)
+        query = query.filter(
+            db.tuple_(timestamp_col, id_col) < db.tuple_(timestamp, id))
+
+    rows = (query
+            .add_columns(timestamp_col, id_col)
+            .order_by(timestamp_col.desc(), id_col.desc())
+            .limit(per_page + 1)
+            .all())
+
+    items = [row[0] for row in rows[:per_page]]
+    next_cursor = None
+    if len(rows) > per_page:
+        _, timestamp, id = rows[per_page - 1]
+        next_cursor = encode_cursor(timestamp, id)
+
+    return Page(items, next_cursor)
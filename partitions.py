@@ -0,0 +1,235 @@
+"""Monthly range partitions for the messages table.
+
+On Postgres (11 or later), migration 10 turns `messages` into a table
+partitioned by RANGE (timestamp), with one partition per calendar month:
+
+    messages_y2024m05  FOR VALUES FROM ('2024-05-01') TO ('2024-06-01')
+
+plus `messages_default` for rows outside every month. Queries that bound
+the timestamp only read the months they need. These include the home
+timeline, which joins on Timeline.timestamp, and any page past a cursor.
+A month that is no longer wanted can be archived by detaching its
+partition, without a large DELETE.
+
+Postgres only lets a foreign key point at a partitioned table if the key
+includes the partition column. So likes and timelines lose their foreign
+keys to messages, and a trigger deletes their rows when a message is
+deleted, as ON DELETE CASCADE did.
+
+Partitions have to exist before their month starts; rows that arrive
+earlier land in the default partition and are moved when their month's
+partition is created. Run this from cron, monthly or more often:
+
+    FLASK_APP=app flask partition-messages
+
+It adds any missing partitions from this month through MONTHS_AHEAD
+months from now. With `--archive-before 2023-01` it also detaches every
+month before January 2023, leaving each as a standalone table to dump and
+drop. Their likes and timeline entries are deleted, and the counters are
+recomputed.
+
+SQLite has no partitioning, so on SQLite these functions do nothing.
+"""
+
+import re
+from datetime import date, datetime
+
+from sqlalchemy import inspect
+
+from models import db, User, utcnow
+
+MONTHS_AHEAD = 3
+
+DEFAULT_PARTITION = 'messages_default'
+
+PARTITION_NAME = re.compile(r'^messages_y(\d{4})m(\d{2})$')
+
+# Set while rows move between partitions, so their likes and timeline
+# entries survive the move.
+MOVING_SETTING = 'warbler.moving_messages'
+
+CASCADE_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION messages_cascade_delete() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('{MOVING_SETTING}', true) = 'on' THEN
+        RETURN OLD;
+    END IF;
+    DELETE FROM likes WHERE message_id = OLD.id;
+    DELETE FROM timelines WHERE message_id = OLD.id;
+    RETURN OLD;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def month_start(when):
+    """First day of the month containing `when`."""
+
+    return date(when.year, when.month, 1)
+
+
+def add_months(month, n):
+    """The month `n` months after `month` (before, if `n` is negative)."""
+
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'messages_y{month.year}m{month.month:02d}'
+
+
+def supported(connection):
+    return connection.dialect.name == 'postgresql'
+
+
+def is_partitioned(connection):
+    """Whether `messages` is already a partitioned table."""
+
+    return bool(connection.scalar(
+        "SELECT count(*) FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'messages' AND pg_table_is_visible(c.oid)"))
+
+
+def partitions(connection):
+    """The months that have a partition, oldest first."""
+
+    rows = connection.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'messages' AND pg_table_is_visible(p.oid)")
+
+    months = []
+    for (name,) in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def create_partition(connection, month):
+    """Add `month`'s partition unless it exists; return whether it was added.
+
+    Any of the month's rows already in the default partition are moved
+    into it.
+    """
+
+    if month in partitions(connection):
+        return False
+
+    name = partition_name(month)
+    bounds = dict(lower=month, upper=add_months(month, 1))
+
+    # Postgres won't attach a partition while the default partition holds
+    # rows for it, so fill it standalone and then attach it.
+    connection.execute(f"CREATE TABLE {name} "
+                       f"(LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    connection.execute(f"SET LOCAL {MOVING_SETTING} = on")
+    connection.execute(db.text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        f"WHERE timestamp >= :lower AND timestamp < :upper RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"), **bounds)
+    connection.execute(f"SET LOCAL {MOVING_SETTING} = off")
+    connection.execute(f"ALTER TABLE messages ATTACH PARTITION {name} "
+                       f"FOR VALUES FROM ('{bounds['lower']}') TO ('{bounds['upper']}')")
+    return True
+
+
+def ensure_partitions(connection, ahead=MONTHS_AHEAD, today=None):
+    """Add partitions from this month through `ahead` months on.
+
+    Returns the names of the partitions added.
+    """
+
+    if not supported(connection) or not is_partitioned(connection):
+        return []
+
+    first = month_start(today or datetime.utcnow())
+    months = [add_months(first, n) for n in range(ahead + 1)]
+    return [partition_name(m) for m in months if create_partition(connection, m)]
+
+
+def archive_partitions(connection, before):
+    """Detach the partitions of every month before `before`.
+
+    Their likes and timeline entries are deleted, and user counters are
+    recomputed. Returns the names of the detached tables.
+    """
+
+    if not supported(connection) or not is_partitioned(connection):
+        return []
+
+    archived = []
+    for month in partitions(connection):
+        if month >= month_start(before):
+            break
+
+        name = partition_name(month)
+        connection.execute(f"ALTER TABLE messages DETACH PARTITION {name}")
+        # detaching doesn't fire the delete trigger
+        connection.execute(f"DELETE FROM likes WHERE message_id IN (SELECT id FROM {name})")
+        connection.execute(f"DELETE FROM timelines WHERE message_id IN (SELECT id FROM {name})")
+        archived.append(name)
+
+    if archived:
+        User.repair_counters(connection)
+    return archived
+
+
+def partition_messages(connection, ahead=MONTHS_AHEAD):
+    """Copy `messages` into a table partitioned by month.
+
+    Does nothing on SQLite or if `messages` is already partitioned.
+    Returns whether it did anything.
+    """
+
+    if not supported(connection) or is_partitioned(connection):
+        return False
+
+    inspector = inspect(connection)
+    for table in ['likes', 'timelines']:
+        for fk in inspector.get_foreign_keys(table):
+            if fk['referred_table'] == 'messages':
+                connection.execute(f"ALTER TABLE {table} DROP CONSTRAINT {fk['name']}")
+
+    # free the old table's names and id sequence for the new one
+    sequence = connection.scalar("SELECT pg_get_serial_sequence('messages', 'id')")
+    pkey = inspector.get_pk_constraint('messages')['name']
+    connection.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    connection.execute(f"ALTER TABLE messages DROP CONSTRAINT {pkey}")
+    connection.execute("DROP INDEX IF EXISTS ix_messages_user_id_timestamp")
+    connection.execute("ALTER TABLE messages RENAME TO messages_unpartitioned")
+
+    now = utcnow().compile(dialect=connection.dialect)
+    connection.execute(f"""
+        CREATE TABLE messages (
+            id INTEGER NOT NULL DEFAULT nextval('{sequence}'),
+            text VARCHAR(140) NOT NULL,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT {now},
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+    connection.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF messages DEFAULT")
+
+    oldest = connection.scalar("SELECT min(timestamp) FROM messages_unpartitioned")
+    month = month_start(oldest or datetime.utcnow())
+    last = add_months(month_start(datetime.utcnow()), ahead)
+    while month <= last:
+        create_partition(connection, month)
+        month = add_months(month, 1)
+
+    connection.execute("INSERT INTO messages (id, text, timestamp, user_id) "
+                       "SELECT id, text, timestamp, user_id FROM messages_unpartitioned")
+    connection.execute("DROP TABLE messages_unpartitioned")
+    connection.execute(f"ALTER SEQUENCE {sequence} OWNED BY messages.id")
+    connection.execute("CREATE INDEX ix_messages_user_id_timestamp "
+                       "ON messages (user_id, timestamp, id)")
+
+    connection.execute(CASCADE_FUNCTION)
+    connection.execute("CREATE TRIGGER messages_cascade_delete "
+                       "AFTER DELETE ON messages FOR EACH ROW "
+                       "EXECUTE PROCEDURE messages_cascade_delete()")
+    return True
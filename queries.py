@@ -0,0 +1,48 @@
+"""Page queries for Warbler.
+
+Each helper loads everything its page renders up front: message authors
+are eager-loaded and relationship sizes come from User's counter
+columns, so a page runs the same handful of SQL statements however many
+rows it shows.
+"""
+
+from models import db, Follows, Likes, Message, User
+
+
+def with_authors(query):
+    """Eager-load each message's author in the same statement."""
+
+    return query.options(db.joinedload(Message.user))
+
+
+def following(user_id):
+    """Query of the users `user_id` follows."""
+
+    return (User
+            .query
+            .join(Follows, Follows.user_being_followed_id == User.id)
+            .filter(Follows.user_following_id == user_id))
+
+
+def followers(user_id):
+    """Query of the users following `user_id`."""
+
+    return (User
+            .query
+            .join(Follows, Follows.user_following_id == User.id)
+            .filter(Follows.user_being_followed_id == user_id))
+
+
+def liked_messages(user_id):
+    """Query of the messages `user_id` has liked, with their authors."""
+
+    return with_authors(Message
+                        .query
+                        .join(Likes, Likes.message_id == Message.id)
+                        .filter(Likes.user_id == user_id))
+
+
+def message_with_author(message_id):
+    """Load one message and its author together, or None."""
+
+    return with_authors(Message.query).filter(Message.id == message_id).first()
@@ -0,0 +1,132 @@
+"""EXPLAIN checks for the queries behind Warbler's hot routes.
+
+Each entry in ROUTE_QUERIES builds the query a route runs for a sample
+user. `find_seq_scans()` EXPLAINs each one and reports any that had to
+fall back to a full table scan, which means an index is missing.
+
+Run it against a seeded database with:
+
+    FLASK_APP=app flask check-query-plans
+"""
+
+import json
+
+from models import db, Follows, Likes, Message, Timeline, User
+import queries
+import search
+
+# Tables whose full scans we care about.
+CHECKED_TABLES = {'users', 'messages', 'follows', 'likes', 'timelines'}
+
+
+def home_timeline(user_id):
+    return (queries.with_authors(Timeline.query_for(user_id))
+            .order_by(Timeline.timestamp.desc(), Timeline.message_id.desc())
+            .limit(21))
+
+
+def profile_messages(user_id):
+    return (Message
+            .query
+            .filter(Message.user_id == user_id)
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(21))
+
+
+def following_page(user_id):
+    return (queries.following(user_id)
+            .order_by(Follows.timestamp.desc(), Follows.user_being_followed_id.desc())
+            .limit(25))
+
+
+def followers_page(user_id):
+    return (queries.followers(user_id)
+            .order_by(Follows.timestamp.desc(), Follows.user_following_id.desc())
+            .limit(25))
+
+
+def likes_page(user_id):
+    return (queries.liked_messages(user_id)
+            .order_by(Likes.timestamp.desc(), Likes.id.desc())
+            .limit(21))
+
+
+def user_search(user_id):
+    return search.search_query('user').limit(24)
+
+
+# route name -> (query builder, dialects whose indexes can serve it)
+ROUTE_QUERIES = {
+    'homepage': (home_timeline, None),
+    'users_show': (profile_messages, None),
+    'show_following': (following_page, None),
+    'users_followers': (followers_page, None),
+    'show_likes': (likes_page, None),
+    # served by pg_trgm or SQLite FTS5; other databases fall back to LIKE
+    'list_users': (user_search, {'postgresql', 'sqlite'}),
+}
+
+
+def explain(connection, query):
+    """Return the plan for `query` as a list of (operation, table) pairs."""
+
+    compiled = query.statement.compile(dialect=connection.dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+
+    if connection.dialect.name == 'postgresql':
+        plan = connection.execute(
+            f"EXPLAIN (FORMAT JSON) {compiled}", params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return list(_pg_nodes(plan[0]['Plan']))
+
+    rows = connection.execute(f"EXPLAIN QUERY PLAN {compiled}", params)
+    return [_sqlite_node(row[-1]) for row in rows]
+
+
+def _pg_nodes(node):
+    yield node['Node Type'], node.get('Relation Name')
+    for child in node.get('Plans', []):
+        yield from _pg_nodes(child)
+
+
+def _sqlite_node(detail):
+    # e.g. "SCAN users", "SEARCH messages USING INDEX ix_... (user_id=?)";
+    # older SQLite versions say "SCAN TABLE users"
+    words = [word for word in detail.split() if word != 'TABLE']
+    table = words[1] if len(words) > 1 else None
+    if words[0] == 'SCAN' and 'USING' not in words:
+        return 'Seq Scan', table
+    return words[0], table
+
+
+def find_seq_scans(user_id=None):
+    """EXPLAIN every route query; return {route: [tables seq-scanned]}.
+
+    On Postgres, sequential scans are disabled for the check so that the
+    planner reports whether an index *could* serve the query even on a
+    small seeded dataset where a scan would be cheaper.
+    """
+
+    if user_id is None:
+        user_id = db.session.query(db.func.min(User.id)).scalar() or 1
+
+    connection = db.session.connection()
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.execute("SET LOCAL enable_seqscan = off")
+
+    failures = {}
+    for route, (build, dialects) in ROUTE_QUERIES.items():
+        if dialects and dialect not in dialects:
+            continue
+
+        scanned = [table for operation, table in explain(connection, build(user_id))
+                   if operation == 'Seq Scan' and table in CHECKED_TABLES]
+        if scanned:
+            failures[route] = scanned
+
+    db.session.rollback()
+    return failures
@@ -0,0 +1,127 @@
+"""Read/write splitting across the primary database and read replicas.
+
+Replicas are listed in DATABASE_REPLICA_URLS and registered as
+Flask-SQLAlchemy binds. Views that only read declare it:
+
+    @app.route('/users/<int:user_id>')
+    @replica_reads
+    def users_show(user_id): ...
+
+A GET to such a view picks one replica at random for its SELECTs. All
+writes, and every statement from any other view, go to the primary. A
+request that does write also switches to the primary for the rest of
+its statements, since the replica can't see its changes yet.
+
+Replicas lag, so a user who just wrote (posted, followed, liked) would
+not see their own change on the next page. Any request that writes
+records that in the session, and that user's requests read from the
+primary for the next REPLICA_STICKY_SECONDS.
+
+With no replicas configured, everything goes to the primary as before.
+"""
+
+import random
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.selectable import SelectBase
+
+from db_pool import PooledSQLAlchemy
+
+# session key: read from the primary until this time.time()
+PRIMARY_UNTIL_KEY = 'db_primary_until'
+
+
+def replica_reads(view):
+    """Let GETs of `view` read from a replica."""
+
+    view.replica_reads = True
+    return view
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends a request's reads to its replica, if it has one."""
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not has_request_context():
+            return super().get_bind(mapper, clause)
+
+        if self._flushing or isinstance(clause, UpdateBase):
+            g.db_wrote = True
+
+        replica = g.get('db_replica')
+        if replica is not None:
+            if not g.get('db_wrote') and isinstance(clause, SelectBase):
+                return self.db.get_engine(self.app, bind=replica)
+            # anything but a plain read (including session.connection())
+            # pins the rest of the request to the primary
+            g.db_replica = None
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(PooledSQLAlchemy):
+    """Flask-SQLAlchemy whose sessions route reads to replicas."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def replica_keys(app):
+    """Bind keys of `app`'s replicas."""
+
+    return app.extensions.get('replicas', [])
+
+
+def configure(app, urls):
+    """Register `urls` as `app`'s replicas, replacing any before."""
+
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for key in replica_keys(app):
+        binds.pop(key, None)
+
+    keys = [f'replica{i}' for i in range(len(urls))]
+    binds.update(zip(keys, urls))
+    app.config['SQLALCHEMY_BINDS'] = binds
+    app.extensions['replicas'] = keys
+
+
+def _choose_database():
+    g.db_replica = None
+    g.db_wrote = False
+
+    keys = replica_keys(current_app)
+    if not keys or request.method not in ('GET', 'HEAD'):
+        return
+
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(view, 'replica_reads', False):
+        return
+    if session.get(PRIMARY_UNTIL_KEY, 0) > time.time():
+        return
+
+    g.db_replica = random.choice(keys)
+
+
+def _remember_write(response):
+    if g.get('db_wrote') and replica_keys(current_app):
+        session[PRIMARY_UNTIL_KEY] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+    return response
+
+
+def init_app(app):
+    """Route `app`'s reads to the replicas in DATABASE_REPLICA_URLS."""
+
+    app.config.setdefault('DATABASE_REPLICA_URLS', [])
+    app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+    configure(app, app.config['DATABASE_REPLICA_URLS'])
+
+    app.before_request(_choose_database)
+    app.after_request(_remember_write)
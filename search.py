@@ -0,0 +1,95 @@
+"""User search for `/users?q=`.
+
+Matches the query anywhere in a user's username, bio or location, ranks
+username matches first, and pages through the results. The matching is
+served by the index models.py sets up for the database in use: a pg_trgm
+GIN index on Postgres, an FTS5 trigram table on SQLite. Any other
+database falls back to an unindexed LIKE.
+"""
+
+from collections import namedtuple
+
+from models import db, User, SEARCH_DOCUMENT_SQL
+
+SearchPage = namedtuple('SearchPage', ['items', 'page', 'has_next'])
+
+# Search results are paged by OFFSET, so keep the deepest page cheap.
+MAX_PAGE = 20
+
+# The trigram tokenizer can't match anything shorter than a trigram.
+MIN_TRIGRAM_LENGTH = 3
+
+
+def _like_pattern(text):
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+def search_query(text):
+    """Ranked (best match first) query of users matching `text`."""
+
+    dialect = db.session.get_bind().dialect.name
+    document = db.literal_column(SEARCH_DOCUMENT_SQL)
+
+    if dialect == 'postgresql':
+        return (User
+                .query
+                .filter(document.ilike(_like_pattern(text), escape='\\'))
+                .order_by(db.func.similarity(User.username, text).desc(),
+                          db.func.word_similarity(text, document).desc(),
+                          User.id))
+
+    if dialect == 'sqlite' and len(text) >= MIN_TRIGRAM_LENGTH:
+        fts = db.table('users_fts', db.column('rowid'))
+        phrase = '"' + text.replace('"', '""') + '"'
+        return (User
+                .query
+                .join(fts, fts.c.rowid == User.id)
+                .filter(db.text("users_fts MATCH :phrase").bindparams(phrase=phrase))
+                # weight username matches over bio and location
+                .order_by(db.text("bm25(users_fts, 10.0, 1.0, 1.0)"), User.id))
+
+    return (User
+            .query
+            .filter(document.like(_like_pattern(text), escape='\\'))
+            .order_by(User.username.like(_like_pattern(text), escape='\\').desc(),
+                      User.id))
+
+
+def search_users(text, page=1, per_page=24):
+    """Return one SearchPage of users matching `text`.
+
+    Raises ValueError for pages past MAX_PAGE.
+    """
+
+    if not 1 <= page <= MAX_PAGE:
+        raise ValueError(f"page must be between 1 and {MAX_PAGE}")
+
+    rows = (search_query(text)
+            .offset((page - 1) * per_page)
+            .limit(per_page + 1)
+            .all())
+
+    return SearchPage(rows[:per_page], page,
+                      len(rows) > per_page and page < MAX_PAGE)
+
+
+def autocomplete(prefix, limit=10):
+    """Usernames starting with `prefix`, alphabetically."""
+
+    if not prefix:
+        return []
+
+    query = db.session.query(User.username)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # served by ix_users_username_prefix (text_pattern_ops)
+        escaped = _like_pattern(prefix)[1:]
+        query = query.filter(User.username.like(escaped, escape='\\'))
+    else:
+        # SQLite's LIKE is case-insensitive and can't use the username
+        # index, but a range scan in its binary collation can
+        query = query.filter(User.username >= prefix,
+                             User.username < prefix + '\uffff')
+
+    rows = query.order_by(User.username).limit(limit)
+    return [username for (username,) in rows]
@@ -1,20 +1,50 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
+
+    python seed.py [--resume] [--batch-size N] [--data-dir DIR]
+
+CSVs are streamed in batches (see loader.py), so this scales to
+load-test sized data. --resume keeps the existing tables and carries on
+from the last committed batch of an interrupted run.
+"""
+
+import argparse
+import os
 
-from csv import DictReader
 from app import db
-from models import User, Message, Follows
+from models import User, Message, Follows, Likes, Timeline
+import loader
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--resume', action='store_true',
+                    help="continue an interrupted load instead of starting over")
+parser.add_argument('--batch-size', type=int, default=10000)
+parser.add_argument('--data-dir', default='generator')
+args = parser.parse_args()
 
+if not args.resume:
+    db.drop_all()
+    db.create_all()
 
-db.drop_all()
-db.create_all()
+for model, filename in [(User, 'users.csv'),
+                        (Message, 'messages.csv'),
+                        (Follows, 'follows.csv'),
+                        (Likes, 'likes.csv')]:
+    path = os.path.join(args.data_dir, filename)
+    if not os.path.exists(path):
+        continue
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+    stats = loader.load_csv(
+        db.engine, model.__table__, path, batch_size=args.batch_size,
+        progress=lambda n: print(f"{model.__tablename__}: {n} rows...", end='\r', flush=True))
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+    rate = stats.rows / stats.seconds if stats.seconds else 0
+    resumed = f" (resumed after {stats.resumed_from})" if stats.resumed_from else ''
+    print(f"{stats.table}: {stats.rows} rows in {stats.seconds:.1f}s, "
+          f"{rate:,.0f} rows/sec{resumed}")
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+# bulk loads skip timeline fan-out and counter maintenance,
+# so build both in one pass each
+Timeline.rebuild()
+User.repair_counters()
 
 db.session.commit()
@@ -0,0 +1,66 @@
+"""JSON shapes for the /api/v1 routes.
+
+Kept small on purpose: a message carries only its author's summary, and
+lists are a page of items plus the `before` cursor for the next page (or
+null on the last one).
+"""
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+def user_summary(user):
+    """What a message or list needs to show a user."""
+
+    return {
+        'id': user.id,
+        'username': user.username,
+        'image_url': user.image_url,
+    }
+
+
+def user_profile(user, following=None):
+    """A user's profile; `following` is whether the viewer follows them."""
+
+    profile = user_summary(user)
+    profile.update({
+        'header_image_url': user.header_image_url,
+        'bio': user.bio,
+        'location': user.location,
+        'message_count': user.message_count,
+        'following_count': user.following_count,
+        'follower_count': user.follower_count,
+        'like_count': user.like_count,
+    })
+    if following is not None:
+        profile['following'] = following
+    return profile
+
+
+def message(msg, liked=None, author=None):
+    """A message with its author; `liked` is whether the viewer likes it.
+
+    Pass `author` when it's already at hand (a profile's messages are all
+    by the profile's user) to skip loading `msg.user`.
+    """
+
+    data = {
+        'id': msg.id,
+        'text': msg.text,
+        'timestamp': msg.timestamp.strftime(TIMESTAMP_FORMAT),
+        'user': user_summary(author or msg.user),
+    }
+    if liked is not None:
+        data['liked'] = liked
+    return data
+
+
+def message_page(page, liked_ids=None, author=None):
+    """A Page of messages, marking the ones in `liked_ids` as liked."""
+
+    return {
+        'items': [message(msg,
+                          liked=None if liked_ids is None else msg.id in liked_ids,
+                          author=author)
+                  for msg in page.items],
+        'next_cursor': page.next_cursor,
+    }
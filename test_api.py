@@ -0,0 +1,144 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message, Follows, Likes, Timeline
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY, fragment_cache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_INLINE'] = True
+app.config['QUERY_BUDGET_STRICT'] = True
+
+
+class APITestCase(TestCase):
+    """Test the /api/v1 routes."""
+
+    def setUp(self):
+        db.drop_all()
+        fragment_cache.clear()
+        db.create_all()
+
+        db.session.add_all([
+            User(id=1, username='author', email='a@email.com', password='HASHED'),
+            User(id=2, username='viewer', email='v@email.com', password='HASHED'),
+        ])
+        db.session.flush()
+        db.session.add(Follows(user_being_followed_id=1, user_following_id=2))
+        # ids 1-3 from the sequence, so the API can add more
+        db.session.add_all([Message(text=f'message {n}', user_id=1) for n in range(1, 4)])
+        db.session.flush()
+        db.session.add(Likes(user_id=2, message_id=3))
+        db.session.commit()
+        Timeline.rebuild()
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 2
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_logged_out(self):
+        client = app.test_client()
+        for method, url in [('GET', '/api/v1/timeline'),
+                            ('POST', '/api/v1/messages'),
+                            ('POST', '/api/v1/users/1/follow'),
+                            ('POST', '/api/v1/messages/1/like')]:
+            resp = client.open(url, method=method)
+            self.assertEqual(resp.status_code, 401, url)
+            self.assertEqual(resp.get_json(), {'error': 'Access unauthorized.'})
+
+    def test_timeline(self):
+        with patch.dict(app.config, MESSAGES_PER_PAGE=2):
+            first = self.client.get('/api/v1/timeline').get_json()
+            second = self.client.get(f"/api/v1/timeline?before={first['next_cursor']}").get_json()
+
+        self.assertEqual([m['id'] for m in first['items']], [3, 2])
+        self.assertEqual([m['liked'] for m in first['items']], [True, False])
+        self.assertEqual(first['items'][0]['user'],
+                         {'id': 1, 'username': 'author', 'image_url': '/static/images/default-pic.png'})
+        self.assertEqual([m['id'] for m in second['items']], [1])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_bad_cursor(self):
+        resp = self.client.get('/api/v1/timeline?before=nonsense')
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('error', resp.get_json())
+
+    def test_profile(self):
+        data = self.client.get('/api/v1/users/1').get_json()
+
+        self.assertEqual(data['user']['username'], 'author')
+        self.assertEqual(data['user']['message_count'], 3)
+        self.assertEqual(data['user']['follower_count'], 1)
+        self.assertTrue(data['user']['following'])
+        self.assertEqual([m['id'] for m in data['messages']['items']], [3, 2, 1])
+        self.assertTrue(data['messages']['items'][0]['liked'])
+
+    def test_own_profile(self):
+        data = self.client.get('/api/v1/users/2').get_json()
+
+        self.assertNotIn('following', data['user'])
+        self.assertEqual(data['messages'], {'items': [], 'next_cursor': None})
+
+    def test_missing_user(self):
+        resp = self.client.get('/api/v1/users/99')
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn('error', resp.get_json())
+
+    def test_follow_toggle(self):
+        resp = self.client.post('/api/v1/users/1/follow')
+        self.assertEqual(resp.get_json(), {'user_id': 1, 'following': False, 'follower_count': 0})
+        self.assertEqual(Timeline.query.filter_by(user_id=2).count(), 0)
+
+        resp = self.client.post('/api/v1/users/1/follow', json={'following': True})
+        self.assertEqual(resp.get_json(), {'user_id': 1, 'following': True, 'follower_count': 1})
+        resp = self.client.post('/api/v1/users/1/follow', json={'following': True})
+        self.assertEqual(resp.get_json()['follower_count'], 1)
+        self.assertEqual(Timeline.query.filter_by(user_id=2).count(), 3)
+
+    def test_follow_self(self):
+        self.assertEqual(self.client.post('/api/v1/users/2/follow').status_code, 403)
+
+    def test_like(self):
+        resp = self.client.post('/api/v1/messages/2/like', json={'liked': True})
+        self.assertEqual(resp.get_json(), {'message_id': 2, 'liked': True, 'like_count': 1})
+
+        self.assertEqual(self.client.post('/api/v1/messages/99/like').status_code, 404)
+
+    def test_add_message(self):
+        resp = self.client.post('/api/v1/messages', json={'text': 'hi there'})
+
+        self.assertEqual(resp.status_code, 201)
+        data = resp.get_json()
+        self.assertEqual(data['text'], 'hi there')
+        self.assertEqual(data['user']['username'], 'viewer')
+        self.assertTrue(resp.headers['Location'].endswith(f"/messages/{data['id']}"))
+        self.assertEqual(User.query.get(2).message_count, 1)
+
+    def test_add_message_invalid(self):
+        for body in [None, {}, {'text': '  '}, {'text': 5}, {'text': 'x' * 141}]:
+            resp = self.client.post('/api/v1/messages', json=body)
+            self.assertEqual(resp.status_code, 400, body)
+            self.assertIn('error', resp.get_json())
+        self.assertEqual(Message.query.count(), 3)
+
+    def test_html_errors_unchanged(self):
+        resp = self.client.get('/users/99')
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn(b'<', resp.data)
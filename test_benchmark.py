@@ -0,0 +1,36 @@
+"""Benchmark report tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_benchmark.py
+
+
+from unittest import TestCase
+
+from benchmark import percentile, regressions
+
+
+class BenchmarkTestCase(TestCase):
+    """Test the report arithmetic (the benchmark itself needs a database)."""
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 95), 95)
+        self.assertEqual(percentile([7], 95), 7)
+
+    def test_regressions(self):
+        baseline = {'routes': {
+            'home': {'p50_ms': 4, 'p95_ms': 10, 'statements': 2},
+            'users': {'p50_ms': 4, 'p95_ms': 10, 'statements': 2},
+            'gone': {'p50_ms': 4, 'p95_ms': 10, 'statements': 2},
+        }}
+        report = {'routes': {
+            'home': {'p50_ms': 4, 'p95_ms': 12, 'statements': 3},
+            'users': {'p50_ms': 4, 'p95_ms': 12, 'statements': 2},
+            'new': {'p50_ms': 4, 'p95_ms': 99, 'statements': 9},
+        }}
+
+        self.assertEqual(regressions(report, baseline, 0.25),
+                         {'home': 'statements 2 -> 3'})
+        self.assertEqual(set(regressions(report, baseline, 0.1)), {'home', 'users'})
@@ -0,0 +1,92 @@
+"""Connection pool tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_db_pool.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine, exc
+
+from db_pool import MeteredQueuePool, engine_options, pool_metrics, pool_status
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+
+
+class EngineOptionsTestCase(TestCase):
+    """Test turning DB_* settings into engine options."""
+
+    def test_postgres(self):
+        options = engine_options({
+            'SQLALCHEMY_DATABASE_URI': 'postgresql:///warbler',
+            'DB_POOL_SIZE': 3,
+            'DB_MAX_OVERFLOW': 2,
+            'DB_STATEMENT_TIMEOUT': 2500,
+        })
+
+        self.assertIs(options['poolclass'], MeteredQueuePool)
+        self.assertEqual(options['pool_size'], 3)
+        self.assertEqual(options['max_overflow'], 2)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['connect_args'],
+                         {'connect_timeout': 5, 'options': '-c statement_timeout=2500'})
+
+    def test_no_statement_timeout(self):
+        options = engine_options({'SQLALCHEMY_DATABASE_URI': 'postgresql:///warbler'})
+        self.assertNotIn('options', options['connect_args'])
+
+    def test_sqlite_keeps_defaults(self):
+        self.assertEqual(engine_options({'SQLALCHEMY_DATABASE_URI': 'sqlite:///w.db'}), {})
+
+    def test_options_follow_each_url(self):
+        config = {'SQLALCHEMY_DATABASE_URI': 'postgresql:///warbler'}
+        self.assertEqual(engine_options(config, 'sqlite:///replica.db'), {})
+        self.assertIn('connect_args', engine_options(config, 'postgresql://replica/warbler'))
+
+
+class PoolMetricsTestCase(TestCase):
+    """Test checkout and wait accounting."""
+
+    def setUp(self):
+        pool_metrics.clear()
+        self.engine = create_engine('sqlite://', poolclass=MeteredQueuePool,
+                                    pool_size=1, max_overflow=0, pool_timeout=0.05,
+                                    connect_args={'check_same_thread': False})
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_checkouts(self):
+        with self.engine.connect() as conn:
+            conn.scalar('SELECT 1')
+            status = pool_status(self.engine.pool)
+            self.assertEqual(status['checked_out'], 1)
+            self.assertEqual(status['utilization'], 1.0)
+
+        with self.engine.connect() as conn:
+            conn.scalar('SELECT 1')
+
+        status = pool_status(self.engine.pool)
+        self.assertEqual(status['checked_out'], 0)
+        self.assertEqual(status['checkouts'], 2)
+        self.assertEqual(status['connects'], 1)
+        self.assertEqual(status['peak_checked_out'], 1)
+
+    def test_timeout(self):
+        with self.engine.connect():
+            with self.assertRaises(exc.TimeoutError):
+                self.engine.connect()
+
+        status = pool_status(self.engine.pool)
+        self.assertEqual(status['timeouts'], 1)
+        self.assertGreaterEqual(status['max_wait_ms'], 50)
+
+    def test_endpoint(self):
+        resp = app.test_client().get('/metrics/pool')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('checkouts', resp.get_json())
@@ -0,0 +1,148 @@
+"""Fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+from fragments import FragmentCache, LRUBackend
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY, fragment_cache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_INLINE'] = True
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test the cache on its own."""
+
+    def setUp(self):
+        self.cache = FragmentCache(maxsize=100)
+        self.renders = 0
+
+    def render(self):
+        self.renders += 1
+        return f'<p>render {self.renders}</p>'
+
+    def card(self, user):
+        return self.cache.user_card(user, 'test', caller=self.render)
+
+    def test_hit_after_miss(self):
+        user = User(id=1)
+
+        self.assertEqual(self.card(user), '<p>render 1</p>')
+        self.assertEqual(self.card(user), '<p>render 1</p>')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_invalidate_user(self):
+        user = User(id=1)
+        msg = Message(id=5, user_id=1)
+        self.card(user)
+        self.cache.message_card(msg, 'test', caller=self.render)
+
+        self.cache.invalidate_user(1)
+
+        self.assertEqual(self.card(user), '<p>render 3</p>')
+        self.assertEqual(self.cache.message_card(msg, 'test', caller=self.render),
+                         '<p>render 4</p>')
+
+    def test_lost_version_never_serves_stale(self):
+        self.cache = FragmentCache(backend=LRUBackend(maxsize=2))
+        user = User(id=1)
+        self.card(user)
+
+        # the version token is the oldest entry; push it out
+        self.cache.backend.set('a', 'x')
+        self.cache.backend.set('b', 'y')
+
+        self.assertEqual(self.card(user), '<p>render 2</p>')
+
+
+class FragmentViewsTestCase(TestCase):
+    """Test cards in pages and their invalidation."""
+
+    def setUp(self):
+        db.drop_all()
+        fragment_cache.clear()
+        db.create_all()
+
+        self.author = User.signup('author', 'a@test.com', 'password', None)
+        self.viewer = User.signup('viewer', 'v@test.com', 'password', None)
+        db.session.commit()
+        self.author_id, self.viewer_id = self.author.id, self.viewer.id
+        db.session.add(Follows(user_being_followed_id=self.author_id,
+                               user_following_id=self.viewer_id))
+        db.session.add(Message(text='hello', user_id=self.author_id))
+        db.session.commit()
+        self.message_id = Message.query.one().id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_cards_are_reused(self):
+        self.login(self.viewer_id)
+
+        self.client.get(f'/users/{self.author_id}')
+        misses = fragment_cache.misses
+        resp = self.client.get(f'/users/{self.author_id}')
+
+        self.assertIn(b'hello', resp.data)
+        self.assertEqual(fragment_cache.misses, misses)
+        self.assertGreater(fragment_cache.hits, 0)
+
+    def test_viewer_parts_are_not_cached(self):
+        self.login(self.viewer_id)
+        self.client.get(f'/users/{self.viewer_id}/following')
+
+        self.login(self.author_id)
+        resp = self.client.get(f'/users/{self.viewer_id}/following')
+
+        self.assertIn(b'@author', resp.data)
+        self.assertNotIn(b'Unfollow', resp.data)
+
+    def test_profile_edit_invalidates(self):
+        self.login(self.author_id)
+        self.client.get('/users')
+        self.client.get(f'/users/{self.author_id}')
+
+        self.client.post('/users/profile', data={
+            'username': 'author', 'email': 'a@test.com', 'password': 'password',
+            'image_url': '/static/images/new-pic.png', 'header_image_url': '', 'bio': ''})
+
+        page = self.client.get('/users').data.decode()
+        self.assertIn('<img src="/static/images/new-pic.png" alt="Image for author"', page)
+        page = self.client.get(f'/users/{self.author_id}').data.decode()
+        self.assertIn('<img src="/static/images/new-pic.png" alt="user image"', page)
+
+    def test_delete_message_invalidates(self):
+        self.login(self.author_id)
+        self.client.get(f'/users/{self.author_id}')
+        version = fragment_cache.version('message', self.message_id)
+
+        self.client.post(f'/messages/{self.message_id}/delete')
+
+        self.assertNotEqual(fragment_cache.version('message', self.message_id), version)
+
+    def test_delete_user_invalidates(self):
+        self.login(self.author_id)
+        version = fragment_cache.version('user', self.author_id)
+
+        self.client.post('/users/delete')
+
+        self.assertNotEqual(fragment_cache.version('user', self.author_id), version)
@@ -0,0 +1,89 @@
+"""Password hasher tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_hashing.py
+
+
+import os
+import threading
+from unittest import TestCase
+
+from models import db, User
+from hashing import HashingBusy, PasswordHasher, calibrate, cost_of, hasher
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test hashing inline and in the worker pool."""
+
+    def test_inline_round_trip(self):
+        h = PasswordHasher()
+        h.workers = 0
+
+        pw_hash = h.generate_password_hash('password', rounds=4)
+        self.assertTrue(pw_hash.startswith('$2b$04$'))
+        self.assertTrue(h.check_password_hash(pw_hash, 'password'))
+        self.assertFalse(h.check_password_hash(pw_hash, 'wrong'))
+
+    def test_pool_round_trip(self):
+        h = PasswordHasher()
+        h.workers = 1
+
+        pw_hash = h.generate_password_hash('password', rounds=4)
+        self.assertTrue(h.check_password_hash(pw_hash, 'password'))
+
+    def test_empty_password(self):
+        with self.assertRaises(ValueError):
+            PasswordHasher().generate_password_hash('')
+
+    def test_needs_rehash(self):
+        h = PasswordHasher()
+        h.rounds = 4
+
+        self.assertEqual(cost_of('$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'), 12)
+        self.assertTrue(h.needs_rehash('$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'))
+        self.assertFalse(h.needs_rehash('$2b$04$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'))
+
+    def test_calibrate(self):
+        rounds, timings = calibrate(target_ms=0, min_rounds=4, max_rounds=6)
+        self.assertEqual(rounds, 4)
+        self.assertEqual(list(timings), [4])
+
+        rounds, timings = calibrate(target_ms=10 ** 6, min_rounds=4, max_rounds=6)
+        self.assertEqual(rounds, 6)
+
+    def test_full_queue_is_refused(self):
+        h = PasswordHasher()
+        h.workers = 0
+        h._slots = threading.BoundedSemaphore(1)
+        h._slots.acquire()
+
+        with self.assertRaises(HashingBusy):
+            h.generate_password_hash('password', rounds=4)
+
+    def test_full_queue_returns_503(self):
+        db.drop_all()
+        db.create_all()
+        db.session.add(User(username='user', email='user@email.com',
+                            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'))
+        db.session.commit()
+
+        slots = hasher._slots
+        hasher._slots = threading.BoundedSemaphore(1)
+        hasher._slots.acquire()
+        try:
+            resp = app.test_client().post('/login', data={'username': 'user',
+                                                          'password': 'password'})
+        finally:
+            hasher._slots = slots
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '1')
@@ -0,0 +1,119 @@
+"""HTTP caching tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_http_cache.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY, fragment_cache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class HTTPCacheTestCase(TestCase):
+    """Test conditional GETs and cache headers."""
+
+    def setUp(self):
+        db.drop_all()
+        fragment_cache.clear()
+        db.create_all()
+
+        self.author = User(id=1, username='author', email='a@email.com', password='HASHED')
+        self.viewer = User(id=2, username='viewer', email='v@email.com', password='HASHED')
+        db.session.add_all([self.author, self.viewer])
+        db.session.flush()
+        db.session.add(Message(id=10, text='hello', user_id=1))
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 2
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def revalidate(self, url):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers['ETag']
+        return etag, self.client.get(url, headers={'If-None-Match': etag})
+
+    def test_unchanged_page_is_not_rendered(self):
+        for url in ['/users/1', '/messages/10']:
+            etag, resp = self.revalidate(url)
+
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b'')
+            self.assertEqual(resp.headers['ETag'], etag)
+            self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+
+    def test_if_modified_since(self):
+        first = self.client.get('/users/1')
+        resp = self.client.get('/users/1', headers={
+            'If-Modified-Since': first.headers['Last-Modified']})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_new_message_changes_etag(self):
+        etag, _ = self.revalidate('/users/1')
+
+        db.session.add(Message(text='another', user_id=1))
+        db.session.commit()
+
+        resp = self.client.get('/users/1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'another', resp.data)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_viewer_like_changes_etag(self):
+        etag, _ = self.revalidate('/users/1')
+
+        self.client.post('/messages/10/like')
+
+        resp = self.client.get('/users/1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'btn-primary', resp.data)
+
+    def test_viewer_follow_changes_etag(self):
+        etag, _ = self.revalidate('/messages/10')
+
+        self.client.post('/users/follow/1')
+
+        resp = self.client.get('/messages/10', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'Unfollow', resp.data)
+
+    def test_template_change_changes_etag(self):
+        etag, _ = self.revalidate('/messages/10')
+
+        with patch('http_cache._templates_digest', 'new templates'):
+            resp = self.client.get('/messages/10', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_missing_message(self):
+        self.assertEqual(self.client.get('/messages/999').status_code, 404)
+
+    def test_static_headers(self):
+        page = self.client.get('/users/1').data.decode()
+        self.assertIn('/static/stylesheets/style.css?v=', page)
+
+        start = page.index('/static/stylesheets/style.css?v=')
+        url = page[start:page.index('"', start)]
+        resp = self.client.get(url)
+        self.assertEqual(resp.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        resp.close()
+
+        resp = self.client.get('/static/stylesheets/style.css')
+        self.assertNotIn('immutable', resp.headers['Cache-Control'])
+        resp.close()
@@ -0,0 +1,117 @@
+"""Identity cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_identity.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User
+from identity import IdentityCache, UserSnapshot
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY, identity_cache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_INLINE'] = True
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class IdentityCacheTestCase(TestCase):
+    """Test the LRU/TTL snapshot cache on its own."""
+
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = IdentityCache(ttl=10, clock=clock)
+        cache.put(UserSnapshot(1, 'user1', None))
+
+        clock.now = 9
+        self.assertEqual(cache.get(1).username, 'user1')
+
+        clock.now = 10
+        self.assertIsNone(cache.get(1))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        cache = IdentityCache(maxsize=2)
+        cache.put(UserSnapshot(1, 'user1', None))
+        cache.put(UserSnapshot(2, 'user2', None))
+        cache.get(1)
+        cache.put(UserSnapshot(3, 'user3', None))
+
+        self.assertIsNotNone(cache.get(1))
+        self.assertIsNone(cache.get(2))
+        self.assertIsNotNone(cache.get(3))
+
+
+class CurrentUserTestCase(TestCase):
+    """Test that a warm cache skips the per-request user lookup."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        identity_cache.clear()
+
+        u = User.signup('user', 'user@email.com', 'password', None)
+        u.id = 111
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def count_statements(self, path):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 111
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                resp = c.get(path)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(resp.status_code, 200)
+        return len(statements)
+
+    def test_warm_cache_saves_user_lookup(self):
+        cold = self.count_statements('/messages/new')
+        warm = self.count_statements('/messages/new')
+
+        self.assertEqual(cold, 1)
+        self.assertEqual(warm, 0)
+
+    def test_profile_edit_invalidates(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 111
+
+            c.get('/messages/new')
+            self.assertEqual(identity_cache.get(111).username, 'user')
+
+            c.post('/users/profile', data={'username': 'user',
+                                           'email': 'new@email.com',
+                                           'password': 'password'})
+            self.assertIsNone(identity_cache.get(111))
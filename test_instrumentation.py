@@ -0,0 +1,78 @@
+"""SQL instrumentation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_instrumentation.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message
+from instrumentation import QueryBudgetExceeded, metrics
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class InstrumentationTestCase(TestCase):
+    """Test per-request query stats, /metrics and query budgets."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.user = User.signup('testuser', 'test@test.com', 'testuser', None)
+        db.session.commit()
+        db.session.add(Message(text='hello', user_id=self.user.id))
+        db.session.commit()
+        self.message_id = Message.query.one().id
+
+        metrics.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_response_headers(self):
+        resp = self.client.get(f'/messages/{self.message_id}')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['X-DB-Queries'], '1')
+        self.assertTrue(resp.headers['Server-Timing'].startswith('db;dur='))
+
+    def test_metrics_endpoint(self):
+        self.client.get(f'/messages/{self.message_id}')
+        self.client.get(f'/messages/{self.message_id}')
+
+        stats = self.client.get('/metrics').get_json()['messages_show']
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['queries'], 2)
+        self.assertEqual(stats['max_queries'], 1)
+        self.assertEqual(stats['over_budget'], 0)
+
+    def test_budget_warns(self):
+        view = app.view_functions['messages_show']
+        with patch.object(view, 'query_budget', 0), \
+                patch.dict(app.config, QUERY_BUDGET_STRICT=False), \
+                self.assertLogs('warbler.sql', 'WARNING') as logs:
+            resp = self.client.get(f'/messages/{self.message_id}')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('messages_show ran 1 queries (budget 0)', logs.output[0])
+        self.assertEqual(metrics.snapshot()['messages_show']['over_budget'], 1)
+
+    def test_budget_fails_when_strict(self):
+        view = app.view_functions['messages_show']
+        with patch.object(view, 'query_budget', 0), \
+                patch.dict(app.config, QUERY_BUDGET_STRICT=True, PROPAGATE_EXCEPTIONS=True):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(f'/messages/{self.message_id}')
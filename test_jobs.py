@@ -0,0 +1,200 @@
+"""Background job tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+import time
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message, Follows, Job, Timeline
+import jobs
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+calls = []
+
+
+@jobs.handler('test.record')
+def record(value):
+    calls.append(value)
+
+
+@jobs.handler('test.fail')
+def fail():
+    raise RuntimeError('boom')
+
+
+class JobQueueTestCase(TestCase):
+    """Test enqueueing, running, retrying and reclaiming jobs."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        calls.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_enqueue_and_run(self):
+        jobs.enqueue('test.record', key='once', value=7)
+        db.session.commit()
+
+        self.assertEqual(jobs.work(app), 1)
+        self.assertEqual(calls, [7])
+
+        job = Job.query.one()
+        self.assertEqual((job.status, job.attempts), ('done', 1))
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(job.idempotency_key)
+
+    def test_idempotency_key(self):
+        self.assertTrue(jobs.enqueue('test.record', key='k', value=1))
+        self.assertFalse(jobs.enqueue('test.record', key='k', value=2))
+        db.session.commit()
+        jobs.work(app)
+
+        # the key is free again once its job is done
+        self.assertTrue(jobs.enqueue('test.record', key='k', value=3))
+        db.session.commit()
+        jobs.work(app)
+
+        self.assertEqual(calls, [1, 3])
+
+    def test_enqueue_is_transactional(self):
+        jobs.enqueue('test.record', value=1)
+        db.session.rollback()
+
+        self.assertEqual(jobs.work(app), 0)
+        self.assertEqual(Job.query.count(), 0)
+
+    def test_retry_with_backoff(self):
+        jobs.enqueue('test.fail', max_attempts=2)
+        db.session.commit()
+
+        jobs.work(app)
+        job = Job.query.one()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_at, datetime.utcnow())
+        self.assertIn('RuntimeError: boom', job.last_error)
+
+        # not due yet
+        self.assertEqual(jobs.work(app), 0)
+
+        job = Job.query.one()
+        job.run_at = datetime.utcnow()
+        db.session.commit()
+        jobs.work(app)
+        job = Job.query.one()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_failed_handler_rolls_back(self):
+        @jobs.handler('test.half')
+        def half():
+            db.session.add(User(username='ghost', email='g@email.com', password='HASHED'))
+            db.session.flush()
+            raise RuntimeError('half done')
+
+        jobs.enqueue('test.half', max_attempts=1)
+        db.session.commit()
+        jobs.work(app)
+
+        self.assertEqual(User.query.count(), 0)
+        self.assertEqual(Job.query.one().status, 'failed')
+
+    def test_unknown_job(self):
+        jobs.enqueue('test.nope', max_attempts=1)
+        db.session.commit()
+        jobs.work(app)
+
+        self.assertIn('No handler', Job.query.one().last_error)
+
+    def test_expired_lease_is_reclaimed(self):
+        jobs.enqueue('test.record', value=1)
+        db.session.commit()
+        job = Job.query.one()
+        job.status = 'running'
+        job.locked_at = datetime.utcnow() - timedelta(seconds=10)
+        db.session.commit()
+
+        with patch.dict(app.config, JOB_LEASE_SECONDS=60):
+            self.assertEqual(jobs.work(app), 0)
+        with patch.dict(app.config, JOB_LEASE_SECONDS=5):
+            self.assertEqual(jobs.work(app), 1)
+        self.assertEqual(calls, [1])
+
+    def test_worker_threads(self):
+        pool = jobs.WorkerPool(app, threads=2, poll_seconds=0.05)
+        pool.start()
+        try:
+            jobs.enqueue('test.record', value=5)
+            db.session.commit()
+            pool.wake()
+
+            deadline = time.time() + 5
+            while not calls and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            pool.stop()
+
+        self.assertEqual(calls, [5])
+
+
+class JobRoutesTestCase(TestCase):
+    """Test the work that routes hand to the queue."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        db.session.add_all([
+            User(id=1, username='author', email='a@email.com', password='HASHED'),
+            User(id=2, username='follower', email='f@email.com', password='HASHED'),
+        ])
+        db.session.flush()
+        db.session.add(Follows(user_being_followed_id=1, user_following_id=2))
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+        self.config = patch.dict(app.config, JOBS_INLINE=False, JOB_WORKERS=0)
+        self.config.start()
+
+    def tearDown(self):
+        self.config.stop()
+        db.session.rollback()
+
+    def test_message_fan_out(self):
+        resp = self.client.post('/messages/new', data={'text': 'hello'})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(Message.query.count(), 1)
+        self.assertEqual(Timeline.query.count(), 0)
+
+        jobs.work(app)
+        self.assertEqual({t.user_id for t in Timeline.query}, {1, 2})
+
+    def test_delete_user(self):
+        db.session.add(Message(text='soon gone', user_id=1))
+        db.session.commit()
+
+        resp = self.client.post('/users/delete')
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertIsNotNone(User.query.get(1))
+
+        jobs.work(app)
+        self.assertIsNone(User.query.get(1))
+        self.assertEqual(User.query.get(2).following_count, 0)
@@ -0,0 +1,84 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import loader
+
+db.create_all()
+
+
+class LoaderTestCase(TestCase):
+    """Test batched, restartable CSV loads."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.dir = tempfile.TemporaryDirectory()
+        self.users_csv = os.path.join(self.dir.name, 'users.csv')
+        with open(self.users_csv, 'w') as f:
+            f.write("email,username,image_url,password,bio,header_image_url,location\n")
+            for i in range(25):
+                f.write(f"user{i}@email.com,user{i},/img.png,HASHED,,/header.png,Place {i}\n")
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        self.dir.cleanup()
+        return res
+
+    def test_load_in_batches(self):
+        seen = []
+        stats = loader.load_csv(db.engine, User.__table__, self.users_csv,
+                                batch_size=10, progress=seen.append)
+
+        self.assertEqual(seen, [10, 20, 25])
+        self.assertEqual(stats.rows, 25)
+        self.assertEqual(stats.resumed_from, 0)
+        self.assertEqual(User.query.count(), 25)
+        self.assertIsNone(User.query.filter_by(username='user0').one().bio)
+
+    def test_resume_skips_committed_rows(self):
+        def fail_after_first_batch(n):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            loader.load_csv(db.engine, User.__table__, self.users_csv,
+                            batch_size=10, progress=fail_after_first_batch)
+        self.assertEqual(User.query.count(), 10)
+
+        stats = loader.load_csv(db.engine, User.__table__, self.users_csv,
+                                batch_size=10)
+
+        self.assertEqual(stats.resumed_from, 10)
+        self.assertEqual(stats.rows, 15)
+        self.assertEqual(User.query.count(), 25)
+
+        # a finished load has nothing left to do
+        self.assertEqual(loader.load_csv(db.engine, User.__table__,
+                                         self.users_csv).rows, 0)
+
+    def test_typed_columns(self):
+        loader.load_csv(db.engine, User.__table__, self.users_csv)
+        path = os.path.join(self.dir.name, 'messages.csv')
+        with open(path, 'w') as f:
+            f.write("text,timestamp,user_id\n")
+            f.write("hello,2017-01-21 11:04:53.522807,1\n")
+
+        loader.load_csv(db.engine, Message.__table__, path)
+
+        msg = Message.query.one()
+        self.assertEqual(msg.timestamp.year, 2017)
+        self.assertEqual(msg.user_id, 1)
@@ -1,8 +1,10 @@
 """Message model tests."""
 
 import os
+from datetime import datetime, timedelta
 from unittest import TestCase
-from models import db, User, Message, Follows, Likes
+from unittest.mock import patch
+from models import db, User, Message, Follows, Likes, Timeline
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
@@ -50,6 +52,22 @@ class MessageModelTestCase(TestCase):
         self.assertEqual(len(self.u.messages), 1)
         self.assertEqual(self.u.messages[0].text, 'Test message')
 
+    def test_timestamps_are_per_message(self):
+        """Each message is stamped when it's inserted, not at import."""
+
+        first = Message(text="first", user_id=self.uid)
+        db.session.add(first)
+        db.session.commit()
+
+        second = Message(text="second", user_id=self.uid)
+        db.session.add(second)
+        db.session.flush()
+
+        # read back with the INSERT
+        self.assertIn('timestamp', second.__dict__)
+        self.assertGreater(second.timestamp, first.timestamp)
+        self.assertLess(datetime.utcnow() - second.timestamp, timedelta(minutes=1))
+
     def test_message_like(self):
         msg1 = Message(
             text="Testing likes",
@@ -69,3 +87,16 @@ class MessageModelTestCase(TestCase):
     
 
     
+
+    def test_timeline_rebuild_is_capped(self):
+        for i in range(5):
+            db.session.add(Message(text=f"msg {i}", user_id=self.uid,
+                                   timestamp=datetime(2020, 1, i + 1)))
+        db.session.commit()
+
+        with patch.object(Timeline, 'MAX_LENGTH', 3):
+            Timeline.rebuild()
+        db.session.commit()
+
+        texts = [m.text for m in Timeline.messages_for(self.uid)]
+        self.assertEqual(texts, ['msg 4', 'msg 3', 'msg 2'])
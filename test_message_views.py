@@ -8,7 +8,7 @@
 import os
 from unittest import TestCase
 
-from models import db, connect_db, Message, User
+from models import db, connect_db, Message, User, Follows, Timeline
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -20,7 +20,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, fragment_cache
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -31,6 +31,10 @@ db.create_all()
 # Don't have WTForms use CSRF at all, since it's a pain to test
 
 app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_INLINE'] = True
+
+# fail any route that runs more queries than its @query_budget
+app.config['QUERY_BUDGET_STRICT'] = True
 
 
 class MessageViewTestCase(TestCase):
@@ -40,6 +44,7 @@ class MessageViewTestCase(TestCase):
         """Create test client, add sample data."""
 
         db.drop_all()
+        fragment_cache.clear()
         db.create_all()
 
         self.client = app.test_client()
@@ -80,6 +85,31 @@ class MessageViewTestCase(TestCase):
             msg = Message.query.one()
             self.assertEqual(msg.text, "Hello")
 
+    def test_add_message_fans_out(self):
+        """Does a new message land on the author's and followers' timelines?"""
+
+        follower = User.signup('follower', 'follower@email.com', 'password', None)
+        follower.id = 5678
+        db.session.add(Follows(user_being_followed_id=self.testuser_id,
+                               user_following_id=5678))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post("/messages/new", data={"text": "Fan me out"})
+
+            msg = Message.query.one()
+            self.assertEqual([m.id for m in Timeline.messages_for(5678)], [msg.id])
+            self.assertEqual([m.id for m in Timeline.messages_for(self.testuser_id)], [msg.id])
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 5678
+
+            resp = c.get("/")
+            self.assertIn("Fan me out", str(resp.data))
+
     def test_add_msg_no_session(self):
         with self.client as c:
             resp = c.post("/messages/new", data={"text": "Hello"}, follow_redirects=True)
@@ -0,0 +1,149 @@
+"""Schema migration and query plan tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+from datetime import date, datetime
+from unittest import TestCase
+
+from sqlalchemy import inspect
+
+from models import db, User, Message, Follows, Likes, Timeline
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import migrations
+import partitions
+import query_plans
+
+db.create_all()
+
+
+def baseline_schema():
+    """The tables as they were before any migration."""
+
+    metadata = db.MetaData()
+    db.Table('users', metadata,
+             db.Column('id', db.Integer, primary_key=True),
+             db.Column('email', db.Text, nullable=False, unique=True),
+             db.Column('username', db.Text, nullable=False, unique=True),
+             db.Column('image_url', db.Text),
+             db.Column('header_image_url', db.Text),
+             db.Column('bio', db.Text),
+             db.Column('location', db.Text),
+             db.Column('password', db.Text, nullable=False))
+    db.Table('follows', metadata,
+             db.Column('user_being_followed_id', db.Integer,
+                       db.ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+             db.Column('user_following_id', db.Integer,
+                       db.ForeignKey('users.id', ondelete='cascade'), primary_key=True))
+    db.Table('messages', metadata,
+             db.Column('id', db.Integer, primary_key=True),
+             db.Column('text', db.String(140), nullable=False),
+             db.Column('timestamp', db.DateTime, nullable=False),
+             db.Column('user_id', db.Integer,
+                       db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False))
+    db.Table('likes', metadata,
+             db.Column('id', db.Integer, primary_key=True),
+             db.Column('user_id', db.Integer, db.ForeignKey('users.id', ondelete='cascade')),
+             db.Column('message_id', db.Integer,
+                       db.ForeignKey('messages.id', ondelete='cascade'), unique=True))
+    return metadata
+
+
+class MigrationsTestCase(TestCase):
+    """Test versioned migrations and the EXPLAIN check."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_upgrade_is_recorded_once(self):
+        applied = migrations.upgrade(db.engine)
+        self.assertEqual([m.version for m in applied],
+                         [m.version for m in migrations.MIGRATIONS])
+
+        self.assertEqual(migrations.upgrade(db.engine), [])
+
+    def test_upgrade_from_baseline(self):
+        db.drop_all()
+        baseline = baseline_schema()
+        baseline.create_all(db.engine)
+        t = baseline.tables
+        with db.engine.begin() as connection:
+            connection.execute(t['users'].insert(), [
+                dict(id=i, username=f'user{i}', email=f'u{i}@email.com', password='HASHED')
+                for i in (1, 2)])
+            connection.execute(t['follows'].insert(),
+                               [dict(user_being_followed_id=1, user_following_id=2)])
+            connection.execute(t['messages'].insert(), [
+                dict(id=1, text='old', timestamp=datetime(2020, 1, 1), user_id=1)])
+            connection.execute(t['likes'].insert(), [dict(id=1, user_id=2, message_id=1)])
+
+        applied = migrations.upgrade(db.engine)
+        self.assertEqual([m.version for m in applied],
+                         [m.version for m in migrations.MIGRATIONS])
+
+        author, fan = User.query.get(1), User.query.get(2)
+        self.assertEqual((author.message_count, author.follower_count), (1, 1))
+        self.assertEqual((fan.following_count, fan.like_count), (1, 1))
+        self.assertEqual(Message.query.get(1).timestamp, datetime(2020, 1, 1))
+        self.assertEqual([m.id for m in Timeline.messages_for(2)], [1])
+
+        db.session.add(Message(text='new', user_id=1))
+        db.session.commit()
+
+    def test_message_timestamp_default_is_added(self):
+        db.drop_all()
+        baseline = baseline_schema()
+        baseline.create_all(db.engine)
+        with db.engine.begin() as connection:
+            connection.execute(baseline.tables['users'].insert(), [
+                dict(id=1, username='user1', email='u1@email.com', password='HASHED')])
+            # the baseline table has no default for timestamp
+            connection.execute(baseline.tables['messages'].insert(), [
+                dict(id=1, text='old', timestamp=datetime(2020, 1, 1), user_id=1)])
+
+        migrations.upgrade(db.engine)
+
+        db.session.add(Message(id=2, text='new', user_id=1))
+        db.session.commit()
+        self.assertEqual(Message.query.get(1).timestamp, datetime(2020, 1, 1))
+        self.assertGreater(Message.query.get(2).timestamp, datetime(2020, 1, 1))
+
+        fks = {fk['referred_table'] for fk in inspect(db.engine).get_foreign_keys('likes')}
+        if db.engine.dialect.name == 'sqlite':
+            # rebuilt in place; likes still point at messages, not the copy
+            self.assertIn('messages', fks)
+        else:
+            # partitioned; a trigger stands in for the foreign key
+            with db.engine.connect() as connection:
+                self.assertTrue(partitions.is_partitioned(connection))
+                self.assertIn(date(2020, 1, 1), partitions.partitions(connection))
+            self.assertNotIn('messages', fks)
+
+    def test_route_queries_use_indexes(self):
+        migrations.upgrade(db.engine)
+
+        for i in range(1, 4):
+            db.session.add(User(id=i, username=f'user{i}', email=f'u{i}@email.com', password='HASHED'))
+        db.session.flush()
+        db.session.add_all([
+            Follows(user_being_followed_id=2, user_following_id=1),
+            Follows(user_being_followed_id=1, user_following_id=3),
+            Message(id=10, text='hello', user_id=2),
+        ])
+        db.session.flush()
+        db.session.add(Likes(user_id=1, message_id=10))
+        db.session.commit()
+
+        self.assertEqual(query_plans.find_seq_scans(user_id=1), {})
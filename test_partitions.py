@@ -0,0 +1,134 @@
+"""Message partitioning tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_partitions.py
+#
+# Partitioning needs Postgres; on SQLite only the month arithmetic and the
+# no-op paths are checked.
+
+
+import os
+from datetime import date, datetime
+from unittest import TestCase
+
+from models import db, User, Message, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import migrations
+import partitions
+
+db.create_all()
+
+
+class PartitionMonthsTestCase(TestCase):
+    """Test naming and stepping through monthly partitions."""
+
+    def test_month_start(self):
+        self.assertEqual(partitions.month_start(datetime(2024, 5, 31, 23, 59)), date(2024, 5, 1))
+
+    def test_add_months(self):
+        self.assertEqual(partitions.add_months(date(2024, 11, 1), 1), date(2024, 12, 1))
+        self.assertEqual(partitions.add_months(date(2024, 11, 1), 3), date(2025, 2, 1))
+        self.assertEqual(partitions.add_months(date(2024, 1, 1), -1), date(2023, 12, 1))
+
+    def test_partition_name(self):
+        name = partitions.partition_name(date(2024, 5, 1))
+        self.assertEqual(name, 'messages_y2024m05')
+        self.assertTrue(partitions.PARTITION_NAME.match(name))
+
+
+class PartitionMaintenanceTestCase(TestCase):
+    """Test that partition maintenance leaves other databases alone."""
+
+    def test_noop_without_postgres(self):
+        with db.engine.begin() as connection:
+            if partitions.supported(connection):
+                self.skipTest("runs against SQLite")
+
+            self.assertFalse(partitions.partition_messages(connection))
+            self.assertEqual(partitions.ensure_partitions(connection), [])
+            self.assertEqual(partitions.archive_partitions(connection, date(2024, 1, 1)), [])
+
+    def test_command(self):
+        result = app.test_cli_runner().invoke(args=['partition-messages'])
+
+        self.assertEqual(result.exit_code, 0)
+
+
+class PartitionedMessagesTestCase(TestCase):
+    """Test migration 10's partitions and their maintenance on Postgres."""
+
+    def setUp(self):
+        if db.engine.dialect.name != 'postgresql':
+            self.skipTest("needs Postgres")
+
+        db.drop_all()
+        db.create_all()
+        migrations.upgrade(db.engine)
+
+        db.session.add_all([
+            User(id=1, username='author', email='a@email.com', password='HASHED'),
+            User(id=2, username='fan', email='f@email.com', password='HASHED'),
+        ])
+        db.session.flush()
+        # no partition covers 2020 yet, so this lands in the default one
+        db.session.add(Message(id=1, text='old', timestamp=datetime(2020, 1, 15), user_id=1))
+        db.session.flush()
+        db.session.add(Likes(user_id=2, message_id=1))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def partition_of(self, message_id):
+        return db.session.execute(
+            "SELECT tableoid::regclass::text FROM messages WHERE id = :id",
+            {'id': message_id}).scalar()
+
+    def test_new_messages_land_in_this_month(self):
+        db.session.add(Message(text='new', user_id=1))
+        db.session.commit()
+
+        message = Message.query.filter_by(text='new').one()
+        self.assertEqual(self.partition_of(message.id),
+                         partitions.partition_name(datetime.utcnow()))
+
+    def test_ensure_partitions(self):
+        with db.engine.begin() as connection:
+            self.assertEqual(partitions.ensure_partitions(connection), [])
+            added = partitions.ensure_partitions(connection, ahead=partitions.MONTHS_AHEAD + 1)
+
+        self.assertEqual(len(added), 1)
+
+    def test_create_partition_moves_rows_from_default(self):
+        self.assertEqual(self.partition_of(1), partitions.DEFAULT_PARTITION)
+
+        with db.engine.begin() as connection:
+            self.assertTrue(partitions.create_partition(connection, date(2020, 1, 1)))
+            self.assertFalse(partitions.create_partition(connection, date(2020, 1, 1)))
+
+        self.assertEqual(self.partition_of(1), 'messages_y2020m01')
+        self.assertEqual(Likes.query.count(), 1)
+
+    def test_deleting_a_message_deletes_its_likes(self):
+        db.session.delete(Message.query.get(1))
+        db.session.commit()
+
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(User.query.get(2).like_count, 0)
+
+    def test_archive_partitions(self):
+        with db.engine.begin() as connection:
+            partitions.create_partition(connection, date(2020, 1, 1))
+            archived = partitions.archive_partitions(connection, date(2020, 2, 1))
+
+        self.assertEqual(archived, ['messages_y2020m01'])
+        self.assertIsNone(Message.query.get(1))
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(User.query.get(1).message_count, 0)
+        self.assertEqual(User.query.get(2).like_count, 0)
+        db.session.execute("DROP TABLE messages_y2020m01")
+        db.session.commit()
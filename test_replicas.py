@@ -0,0 +1,94 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+#
+# A second SQLite file stands in for the replica.
+
+
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message
+import replicas
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY, identity_cache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+def add_rows(target, label):
+    """Two users and a message, labelled with which database holds them."""
+
+    target.execute(User.__table__.insert(), [
+        dict(id=1, username=f'{label}-author', email='a@email.com', password='HASHED'),
+        dict(id=2, username=f'{label}-viewer', email='v@email.com', password='HASHED'),
+    ])
+    target.execute(Message.__table__.insert(), [
+        dict(id=1, text=f'from {label}', user_id=1),
+    ])
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test which database each request reads."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        identity_cache.clear()
+
+        self.replica_dir = tempfile.TemporaryDirectory()
+        replicas.configure(app, [f"sqlite:///{os.path.join(self.replica_dir.name, 'replica.db')}"])
+        with app.app_context():
+            self.replica = db.get_engine(app, bind='replica0')
+            db.Model.metadata.create_all(self.replica)
+            add_rows(self.replica, 'replica')
+        add_rows(db.session, 'primary')
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.replica.dispose()
+        replicas.configure(app, [])
+        self.replica_dir.cleanup()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_read_only_route_uses_replica(self):
+        resp = self.client.get('/messages/1')
+        self.assertIn(b'from replica', resp.data)
+
+    def test_other_routes_use_primary(self):
+        self.login(1)
+        resp = self.client.get('/users/profile')
+        self.assertIn(b'primary-author', resp.data)
+
+    def test_reads_after_a_write_use_primary(self):
+        self.login(2)
+        self.client.post('/messages/1/like')
+
+        self.assertEqual(db.session.execute('SELECT count(*) FROM likes').scalar(), 1)
+        self.assertEqual(self.replica.scalar('SELECT count(*) FROM likes'), 0)
+        self.assertIn(b'from primary', self.client.get('/messages/1').data)
+
+    def test_sticky_window_ends(self):
+        self.login(2)
+        with patch.dict(app.config, REPLICA_STICKY_SECONDS=0):
+            self.client.post('/messages/1/like')
+
+        self.assertIn(b'from replica', self.client.get('/messages/1').data)
+
+    def test_without_replicas(self):
+        replicas.configure(app, [])
+        self.assertIn(b'from primary', self.client.get('/messages/1').data)
@@ -9,7 +9,8 @@ import os
 from unittest import TestCase
 from sqlalchemy.exc import IntegrityError
 
-from models import db, User, Message, Follows
+from models import db, User, Message, Follows, Likes
+from hashing import hasher
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -108,6 +109,16 @@ class UserModelTestCase(TestCase):
         self.assertTrue(self.u2.is_followed_by(self.u1))
         self.assertFalse(self.u1.is_followed_by(self.u2))
 
+    def test_following_ids(self):
+        u3 = User(id=333, email='u3@email.com', username='user3', password='HASHED')
+        db.session.add(u3)
+        self.u1.following.append(self.u2)
+        db.session.commit()
+
+        self.assertEqual(self.u1.following_ids([self.uid2, 333]), {self.uid2})
+        self.assertEqual(self.u2.following_ids([self.uid1, 333]), set())
+        self.assertEqual(self.u1.following_ids([]), set())
+
 
     ##### Signup Tests #################################
 
@@ -153,14 +164,72 @@ class UserModelTestCase(TestCase):
 
     def test_invalid_password(self):
         self.assertFalse(User.authenticate('user1', 'wrong'))
-      
 
+    def test_auth_rehashes_at_new_cost(self):
+        rounds = hasher.rounds
+        hasher.rounds = 4
+        try:
+            self.assertIn('$2b$12$', self.u1.password)
 
+            user = User.authenticate('user1', 'password')
+            db.session.commit()
 
-        
+            self.assertIn('$2b$04$', user.password)
+            self.assertTrue(User.authenticate('user1', 'password'))
+        finally:
+            hasher.rounds = rounds
 
 
-        
+    ##### Counter Tests #################################
 
+    def test_follow_counters(self):
+        self.u1.following.append(self.u2)
+        db.session.commit()
+
+        self.assertEqual(self.u1.following_count, 1)
+        self.assertEqual(self.u2.follower_count, 1)
+
+        self.u1.following.remove(self.u2)
+        db.session.commit()
+
+        self.assertEqual(self.u1.following_count, 0)
+        self.assertEqual(self.u2.follower_count, 0)
+
+    def test_message_and_like_counters(self):
+        msg = Message(text='counted', user_id=self.uid2)
+        db.session.add(msg)
+        db.session.commit()
+        self.assertEqual(self.u2.message_count, 1)
 
+        db.session.add(Likes(user_id=self.uid1, message_id=msg.id))
+        db.session.commit()
+        self.assertEqual(self.u1.like_count, 1)
+
+        db.session.delete(msg)
+        db.session.commit()
+        self.assertEqual(self.u2.message_count, 0)
+        self.assertEqual(self.u1.like_count, 0)
+
+    def test_delete_user_counters(self):
+        self.u1.following.append(self.u2)
+        self.u2.following.append(self.u1)
+        db.session.commit()
+
+        db.session.delete(self.u2)
+        db.session.commit()
+
+        self.assertEqual(self.u1.following_count, 0)
+        self.assertEqual(self.u1.follower_count, 0)
+
+    def test_repair_counters(self):
+        db.session.add(Follows(user_being_followed_id=self.uid2, user_following_id=self.uid1))
+        db.session.commit()
+        User.query.update({User.following_count: 5, User.follower_count: 5})
+        db.session.commit()
+
+        User.repair_counters()
+        db.session.commit()
 
+        self.assertEqual(self.u1.following_count, 1)
+        self.assertEqual(self.u1.follower_count, 0)
+        self.assertEqual(self.u2.follower_count, 1)
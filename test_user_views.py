@@ -6,9 +6,13 @@
 
 
 import os
+from contextlib import contextmanager
+from datetime import datetime
 from unittest import TestCase
 
-from models import db, connect_db, Message, User, Likes, Follows
+from sqlalchemy import event
+
+from models import db, connect_db, Message, User, Likes, Follows, Timeline
 from bs4 import BeautifulSoup
 
 # BEFORE we import our app, let's set an environmental variable
@@ -21,7 +25,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, fragment_cache
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -32,6 +36,26 @@ db.create_all()
 # Don't have WTForms use CSRF at all, since it's a pain to test
 
 app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_INLINE'] = True
+
+# fail any route that runs more queries than its @query_budget
+app.config['QUERY_BUDGET_STRICT'] = True
+
+
+@contextmanager
+def count_statements():
+    """Count the SQL statements run inside the block."""
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
 
 
 class UserViewTestCase(TestCase):
@@ -41,6 +65,7 @@ class UserViewTestCase(TestCase):
         """Create test client, add sample data."""
 
         db.drop_all()
+        fragment_cache.clear()
         db.create_all()
 
         self.client = app.test_client()
@@ -97,6 +122,42 @@ class UserViewTestCase(TestCase):
             self.assertNotIn('user3', str(resp.data))
             self.assertNotIn('user4', str(resp.data))
 
+    def test_user_search_bio_and_location(self):
+        self.u1.bio = 'I love birdwatching'
+        self.u2.location = 'Birdsville'
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.get('/users?q=bird')
+
+            self.assertIn('user1', str(resp.data))
+            self.assertIn('user2', str(resp.data))
+            self.assertNotIn('user3', str(resp.data))
+
+    def test_user_list_paginates(self):
+        app.config['USERS_PER_PAGE'] = 3
+        try:
+            with self.client as c:
+                resp = c.get('/users')
+                soup = BeautifulSoup(resp.data, 'html.parser')
+                self.assertEqual(len(soup.select('.card-link')), 3)
+
+                more = soup.find('a', string='More users')
+                resp = c.get(more['href'])
+                soup = BeautifulSoup(resp.data, 'html.parser')
+                self.assertEqual(len(soup.select('.card-link')), 2)
+                self.assertIsNone(soup.find('a', string='More users'))
+        finally:
+            app.config['USERS_PER_PAGE'] = 24
+
+    def test_user_autocomplete(self):
+        with self.client as c:
+            resp = c.get('/users/autocomplete?q=user')
+            self.assertEqual(resp.json['usernames'], ['user1', 'user2', 'user3', 'user4'])
+
+            resp = c.get('/users/autocomplete?q=test')
+            self.assertEqual(resp.json['usernames'], ['testuser'])
+
     def test_user_show(self):
         with self.client as c:
             resp = c.get(f"/users/{self.testuser_id}")
@@ -184,6 +245,100 @@ class UserViewTestCase(TestCase):
 
             self.assertEqual(like_count, Likes.query.count())
 
+    def test_many_users_like_one_message(self):
+        self.setup_likes()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            resp = c.post("/messages/2468/like.json")
+            self.assertEqual(resp.json, {'message_id': 2468, 'liked': True, 'like_count': 2})
+
+            resp = c.post("/messages/2468/like.json")
+            self.assertEqual(resp.json, {'message_id': 2468, 'liked': False, 'like_count': 1})
+
+        self.assertEqual(User.query.get(self.u2_id).like_count, 0)
+
+    def test_like_json_is_idempotent(self):
+        db.session.add(Message(id=444, text='add like', user_id=self.u1_id))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            for _ in range(2):
+                resp = c.post("/messages/444/like.json", json={'liked': True})
+                self.assertEqual(resp.json['liked'], True)
+                self.assertEqual(resp.json['like_count'], 1)
+            self.assertEqual(User.query.get(self.testuser_id).like_count, 1)
+
+            for _ in range(2):
+                resp = c.post("/messages/444/like.json", json={'liked': False})
+                self.assertEqual(resp.json['liked'], False)
+                self.assertEqual(resp.json['like_count'], 0)
+            self.assertEqual(User.query.get(self.testuser_id).like_count, 0)
+
+    def test_like_json_errors(self):
+        db.session.add(Message(id=444, text='own message', user_id=self.testuser_id))
+        db.session.commit()
+
+        with self.client as c:
+            self.assertEqual(c.post("/messages/444/like.json").status_code, 401)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            self.assertEqual(c.post("/messages/444/like.json").status_code, 403)
+            self.assertEqual(c.post("/messages/999/like.json").status_code, 404)
+
+    def test_like_toggle_does_not_load_likes(self):
+        db.session.add(Message(id=444, text='add like', user_id=self.u1_id))
+        for i in range(20):
+            db.session.add(Message(id=500 + i, text=f'msg {i}', user_id=self.u2_id))
+        db.session.flush()
+        for i in range(20):
+            db.session.add(Likes(user_id=self.testuser_id, message_id=500 + i))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            with count_statements() as statements:
+                c.post("/messages/444/like")
+
+        self.assertFalse(any('FROM messages, likes' in s for s in statements))
+        self.assertEqual(User.query.get(self.testuser_id).like_count, 21)
+
+    def test_like_buttons_show_viewers_likes(self):
+        db.session.add_all([Message(id=1, text='liked by viewer', user_id=self.u1_id),
+                            Message(id=2, text='liked by owner', user_id=self.u1_id)])
+        db.session.flush()
+        db.session.add_all([Likes(user_id=self.testuser_id, message_id=1),
+                            Likes(user_id=self.u1_id, message_id=2),
+                            Follows(user_being_followed_id=self.u1_id,
+                                    user_following_id=self.testuser_id)])
+        db.session.commit()
+        Timeline.rebuild()
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            for url in ['/', f'/users/{self.u1_id}']:
+                soup = BeautifulSoup(c.get(url).data, 'html.parser')
+                buttons = {a['href']: a.button['class'] for a in soup.select('a.messages-like')}
+                self.assertIn('btn-primary', buttons['/messages/1/like'])
+                self.assertIn('btn-secondary', buttons['/messages/2/like'])
+
+            soup = BeautifulSoup(c.get(f'/users/{self.testuser_id}/likes').data, 'html.parser')
+            buttons = {a['href']: a.button['class'] for a in soup.select('a.messages-like')}
+            self.assertEqual(list(buttons), ['/messages/1/like'])
+            self.assertIn('btn-primary', buttons['/messages/1/like'])
+
     def setup_followers(self):
         f1 = Follows(user_being_followed_id=self.u1_id, user_following_id=self.testuser_id)
         f2 = Follows(user_being_followed_id=self.u2_id, user_following_id=self.testuser_id)
@@ -254,10 +409,127 @@ class UserViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn("Access unauthorized.", str(resp.data))
 
+    def test_follow_backfills_timeline(self):
+        m = Message(id=999, text='backfilled msg', user_id=self.u1_id)
+        db.session.add(m)
+        db.session.commit()
 
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post(f"/users/follow/{self.u1_id}")
+            resp = c.get("/")
+            self.assertIn('backfilled msg', str(resp.data))
+
+            c.post(f"/users/stop-following/{self.u1_id}")
+            resp = c.get("/")
+            self.assertNotIn('backfilled msg', str(resp.data))
+            self.assertEqual(Timeline.query.filter_by(user_id=self.testuser_id).count(), 0)
+
+    def test_user_show_paginates(self):
+        for i in range(5):
+            db.session.add(Message(id=100 + i, text=f'paged msg {i}', user_id=self.testuser_id))
+        db.session.commit()
+
+        app.config['MESSAGES_PER_PAGE'] = 2
+        try:
+            with self.client as c:
+                seen = []
+                url = f"/users/{self.testuser_id}"
+                while url:
+                    resp = c.get(url)
+                    self.assertEqual(resp.status_code, 200)
+                    soup = BeautifulSoup(resp.data, 'html.parser')
+                    seen.extend(p.text for p in soup.select('#messages .message-area p'))
+                    older = soup.find('a', string='Older messages')
+                    url = older['href'] if older else None
+
+                self.assertEqual(seen, [f'paged msg {i}' for i in range(4, -1, -1)])
+
+                resp = c.get(f"/users/{self.testuser_id}?before=garbage")
+                self.assertEqual(resp.status_code, 400)
+        finally:
+            app.config['MESSAGES_PER_PAGE'] = 20
+
+    def test_followers_and_likes_paginate_newest_first(self):
+        followers = [self.u1_id, self.u2_id, self.u3_id, self.u4_id]
+        for i, follower in enumerate(followers):
+            db.session.add(Follows(user_being_followed_id=self.testuser_id,
+                                   user_following_id=follower,
+                                   timestamp=datetime(2020, 1, 1 + i)))
+            db.session.add(Message(id=100 + i, text=f'liked msg {i}', user_id=follower))
+        db.session.flush()
+        for i in range(4):
+            # liked in the opposite order to the message ids
+            db.session.add(Likes(user_id=self.testuser_id, message_id=103 - i,
+                                 timestamp=datetime(2020, 1, 1 + i)))
+        db.session.commit()
+
+        def crawl(c, url, link_text, selector):
+            seen = []
+            while url:
+                soup = BeautifulSoup(c.get(url).data, 'html.parser')
+                seen.append([e.text for e in soup.select(selector)])
+                more = soup.find('a', string=link_text)
+                url = more['href'] if more else None
+            return seen
+
+        app.config['USERS_PER_PAGE'] = 3
+        app.config['MESSAGES_PER_PAGE'] = 3
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser_id
+
+                self.assertEqual(
+                    crawl(c, f"/users/{self.testuser_id}/followers", 'More', '.card-link p'),
+                    [['@user4', '@user3', '@user2'], ['@user1']])
+                self.assertEqual(
+                    crawl(c, f"/users/{self.testuser_id}/likes", 'Older likes', '.message-area p'),
+                    [['liked msg 0', 'liked msg 1', 'liked msg 2'], ['liked msg 3']])
+        finally:
+            app.config['USERS_PER_PAGE'] = 24
+            app.config['MESSAGES_PER_PAGE'] = 20
+
+    def test_likes_page_statement_count_is_fixed(self):
+        authors = [self.u1_id, self.u2_id, self.u3_id]
+        for i, author in enumerate(authors):
+            db.session.add(Message(id=500 + i, text=f'liked {i}', user_id=author))
+        db.session.commit()
+
+        def render_likes():
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser_id
+                with count_statements() as statements:
+                    resp = c.get(f"/users/{self.testuser_id}/likes")
+                self.assertEqual(resp.status_code, 200)
+                return len(statements)
 
+        db.session.add(Likes(user_id=self.testuser_id, message_id=500))
+        db.session.commit()
+        one_like = render_likes()
 
+        db.session.add_all([Likes(user_id=self.testuser_id, message_id=501),
+                            Likes(user_id=self.testuser_id, message_id=502)])
+        db.session.commit()
+        self.assertEqual(render_likes(), one_like)
 
+    def test_delete_user_updates_counters(self):
+        self.setup_followers()
+        db.session.add(Message(text='soon gone', user_id=self.testuser_id))
+        db.session.commit()
 
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
 
+            resp = c.post("/users/delete")
+            self.assertEqual(resp.status_code, 302)
 
+        self.assertIsNone(User.query.get(self.testuser_id))
+        u1 = User.query.get(self.u1_id)
+        self.assertEqual(u1.follower_count, 0)
+        self.assertEqual(u1.following_count, 0)
+        self.assertEqual(User.query.get(self.u2_id).follower_count, 0)
@@ -0,0 +1,70 @@
+"""Template cache and warmup tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_warmup.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from jinja2 import FileSystemBytecodeCache
+
+from models import db
+import warmup
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+
+db.create_all()
+
+
+class WarmupTestCase(TestCase):
+    """Test template precompiling and pool priming."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.bytecode_cache = app.jinja_env.bytecode_cache
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(self.cache_dir.name)
+        app.jinja_env.cache.clear()
+
+    def tearDown(self):
+        app.jinja_env.bytecode_cache = self.bytecode_cache
+        self.cache_dir.cleanup()
+
+    def test_app_templates(self):
+        names = warmup.app_templates(app)
+
+        self.assertIn('base.html', names)
+        self.assertIn('users/detail.html', names)
+        self.assertFalse([n for n in names if n.startswith('_debug_toolbar')])
+
+    def test_warm(self):
+        stats = warmup.warm(app)
+
+        self.assertEqual(stats['templates'], len(warmup.app_templates(app)))
+        self.assertGreaterEqual(stats['connections'], 1)
+        self.assertEqual(len(os.listdir(self.cache_dir.name)), stats['templates'])
+
+    def test_bytecode_cache_is_reused(self):
+        warmup.compile_templates(app)
+        app.jinja_env.cache.clear()
+
+        # a new worker loads the compiled code rather than compiling again
+        compiled = []
+        compile_source = app.jinja_env.compile
+        app.jinja_env.compile = lambda *args, **kw: compiled.append(args) or compile_source(*args, **kw)
+        try:
+            warmup.compile_templates(app)
+        finally:
+            del app.jinja_env.compile
+
+        self.assertEqual(compiled, [])
+
+    def test_warmup_command(self):
+        result = app.test_cli_runner().invoke(args=['warmup'])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('templates', result.output)
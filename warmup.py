@@ -0,0 +1,90 @@
+"""Template bytecode cache and worker warmup.
+
+Jinja compiles a template to Python source the first time it's rendered
+and keeps the result in memory, so every new worker pays for compiling
+base.html, home.html, detail.html and the rest on its first requests.
+
+- `init_app()` gives the app's Jinja environment a bytecode cache on disk
+  (TEMPLATE_CACHE_DIR, by default a per-user directory Jinja picks under
+  the system temp dir). A restarted worker loads compiled templates from
+  there instead of compiling them; Jinja checks each entry against its
+  template's source, so edited templates are recompiled.
+- `warm()` loads every template under templates/ (filling both the
+  in-memory and the on-disk cache) and opens the connection pools of the
+  primary and any replicas, so a worker pays for both before it takes
+  traffic rather than on its first requests. app.py runs it at import time when WARMUP
+  is set; `flask warmup` runs it as a deploy step.
+
+Run workers without preloading the app (e.g. no gunicorn --preload) when
+WARMUP is on: connections opened before a fork can't be shared.
+"""
+
+import time
+
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.pool import QueuePool
+
+from models import db
+from replicas import replica_keys
+
+
+def app_templates(app):
+    """Names of the templates in the app's own templates folder."""
+
+    return sorted(app.jinja_loader.list_templates())
+
+
+def compile_templates(app):
+    """Load (compiling if need be) every app template; return how many."""
+
+    names = app_templates(app)
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def prime_pool(engine):
+    """Open and return the pool's connections; return how many were opened."""
+
+    size = engine.pool.size() if isinstance(engine.pool, QueuePool) else 1
+    connections = []
+    try:
+        for _ in range(size):
+            conn = engine.connect()
+            conn.scalar('SELECT 1')
+            connections.append(conn)
+    finally:
+        for conn in connections:
+            conn.close()
+    return len(connections)
+
+
+def warm(app):
+    """Compile templates and fill the connection pools; return timings."""
+
+    start = time.perf_counter()
+    templates = compile_templates(app)
+    compiled = time.perf_counter()
+
+    with app.app_context():
+        connections = prime_pool(db.engine)
+        for key in replica_keys(app):
+            connections += prime_pool(db.get_engine(app, bind=key))
+    done = time.perf_counter()
+
+    stats = {
+        'templates': templates,
+        'templates_ms': round((compiled - start) * 1000, 3),
+        'connections': connections,
+        'connections_ms': round((done - compiled) * 1000, 3),
+    }
+    app.logger.info("Warmed up: %(templates)d templates in %(templates_ms)s ms, "
+                    "%(connections)d connections in %(connections_ms)s ms", stats)
+    return stats
+
+
+def init_app(app):
+    """Cache `app`'s compiled templates on disk."""
+
+    app.config.setdefault('TEMPLATE_CACHE_DIR', None)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])